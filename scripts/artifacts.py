@@ -0,0 +1,146 @@
+import hashlib
+import json
+import os
+
+
+class Stage:
+
+    def __init__(self, name: str, args: dict, inputs: list, outputs: list, ignore: tuple = ()):
+        """
+        Fingerprint of a run of a pipeline stage (script), with --cached a stage is skipped if its outputs were
+        created by a run with the same fingerprint, the fingerprint changes with the arguments and with the content
+        of the inputs, so a stage is run again when an upstream stage changed its outputs
+        :param name: the name of the stage
+        :param args: the docopt arguments of the script
+        :param inputs: keys of the arguments that are input files or directories
+        :param outputs: the output files or directories
+        :param ignore: keys of the arguments that do not change the outputs (e.g. number of workers)
+        """
+        self.cached = args.get('--cached', False)
+        self.outputs = [output for output in outputs if output]
+        self.fingerprint = None
+        if self.cached:
+            parameters = {}
+            for key, value in sorted(args.items()):
+                if key in ignore or key == '--cached' or value in self.outputs:
+                    continue
+                if key in inputs and isinstance(value, list):
+                    value = [file_fingerprint(file) for file in value]
+                elif key in inputs and value:
+                    value = file_fingerprint(value)
+                parameters[key] = value
+            self.fingerprint = digest(json.dumps([name, parameters], sort_keys=True).encode("utf-8"))
+
+    def up_to_date(self):
+        """
+        Check whether all outputs exist and were created by a run with the same fingerprint
+        :return: True if the stage can be skipped (only with --cached)
+        """
+        if not self.cached:
+            return False
+        for output in self.outputs:
+            record = read_record(output)
+            if record is None or record["stage"] != self.fingerprint:
+                return False
+        return True
+
+    def done(self):
+        """
+        Record the fingerprint next to each output (<output>.fingerprint), after all outputs were saved
+        """
+        if not self.cached:
+            return
+        for i, output in enumerate(self.outputs):
+            record = {"stage": self.fingerprint,
+                      "artifact": digest((self.fingerprint + ":" + str(i)).encode("utf-8")),
+                      "stat": stat_fingerprint(output)}
+            with open(output + ".fingerprint", "w") as recordFile:
+                json.dump(record, recordFile)
+
+
+def read_record(file: str):
+    """
+    Read the fingerprint recorded for an output, if it was not changed since
+    :param file: the output file or directory
+    :return: the record as dict, None if there is none or the output was changed
+    """
+    if not os.path.exists(file) or not os.path.exists(file + ".fingerprint"):
+        return None
+    with open(file + ".fingerprint") as recordFile:
+        record = json.load(recordFile)
+    if record.get("stat") != stat_fingerprint(file):
+        return None
+    return record
+
+
+def file_fingerprint(file: str):
+    """
+    Fingerprint of an input, the recorded fingerprint for the output of a stage, the hash of the content otherwise
+    :param file: the file or directory
+    :return: hex digest
+    """
+    record = read_record(file)
+    if record is not None:
+        return record["artifact"]
+    return content_fingerprint(file)
+
+
+def quick_fingerprint(file: str):
+    """
+    Fingerprint of an input without reading its content, the recorded fingerprint for the output of a stage,
+    the sizes and modification times of its files otherwise (changes when the input is rewritten)
+    :param file: the file or directory
+    :return: hex digest
+    """
+    record = read_record(file)
+    if record is not None:
+        return record["artifact"]
+    return stat_fingerprint(file)
+
+
+def content_fingerprint(file: str):
+    """
+    Hash the content of a file, or of all files of a directory together with their relative paths
+    :param file: the file or directory
+    :return: hex digest
+    """
+    sha = hashlib.sha256()
+    for path in walk(file):
+        if os.path.isdir(file):
+            sha.update(os.path.relpath(path, file).encode("utf-8") + b"\0")
+        with open(path, "rb") as content:
+            for block in iter(lambda: content.read(1 << 20), b""):
+                sha.update(block)
+    return sha.hexdigest()
+
+
+def stat_fingerprint(file: str):
+    """
+    Hash the sizes and modification times of a file or of all files of a directory, changes when an output is rewritten
+    :param file: the file or directory
+    :return: hex digest
+    """
+    entries = []
+    for path in walk(file):
+        status = os.stat(path)
+        entries.append([os.path.relpath(path, file), status.st_size, status.st_mtime_ns])
+    return digest(json.dumps(entries).encode("utf-8"))
+
+
+def walk(file: str):
+    """
+    Get a file or all files of a directory in a fixed order
+    :param file: the file or directory
+    :return: list of paths
+    """
+    if not os.path.isdir(file):
+        return [file]
+    paths = []
+    for root, directories, files in os.walk(file):
+        directories.sort()
+        paths.extend(os.path.join(root, name) for name in sorted(files))
+    return paths
+
+
+def digest(data: bytes):
+    return hashlib.sha256(data).hexdigest()
@@ -0,0 +1,84 @@
+import importlib
+import os
+import sys
+from docopt import docopt
+
+USAGE = """Run the scripts of the hypernymy experiments, see hypfreq <command> --help for the arguments of a command
+
+    Usage:
+        hypfreq <command> [<args>...]
+        hypfreq (-h | --help)
+
+    Commands:
+        dsm cache          pre-tokenize a corpus (dsm_creation/corpus_cache.py)
+        dsm create         create DSM's from a corpus (dsm_creation/dsm_creation.py)
+        dsm combine        combine DSM's and word frequencies (dsm_creation/dsm_combine.py)
+        dsm convert        convert a pickled DSM into a SparseDSM (dsm_creation/dsm_convert.py)
+        dsm share          place a DSM in shared memory (dsm_creation/dsm_share.py)
+        rowsums            calculate the row sums of a DSM (dsm_creation/rowSums.py)
+        dataset read       read a data set (dataset_processing/read_dataset.py)
+        dataset filter     filter a data set (dataset_processing/filter_dataset.py)
+        dataset subsets    create frequency subsets of a data set (dataset_processing/freqDiff_freqBias.py)
+        plmi               calculate PLMI (dsm_creation/plmi.py)
+        measure weedsprec  calculate WeedsPrec (measures/weedsPrec.py)
+        measure invcl      calculate InvCL (measures/invCL.py)
+        measure slqsrow    calculate SLQS Row (measures/slqsRow.py)
+        measure slqs       calculate SLQS (measures/slqs.py)
+        pipeline           calculate PLMI and the measures in one process (pipeline.py)
+        evaluate           evaluate the measures (evaluation/evaluation.py)
+        classify           classify with frequency, length and SLQS (evaluation/classification.py)
+
+"""
+
+# command: script relative to this directory, a script is only imported when its command runs
+COMMANDS = {"dsm cache": "dsm_creation/corpus_cache.py",
+            "dsm create": "dsm_creation/dsm_creation.py",
+            "dsm combine": "dsm_creation/dsm_combine.py",
+            "dsm convert": "dsm_creation/dsm_convert.py",
+            "dsm share": "dsm_creation/dsm_share.py",
+            "rowsums": "dsm_creation/rowSums.py",
+            "dataset read": "dataset_processing/read_dataset.py",
+            "dataset filter": "dataset_processing/filter_dataset.py",
+            "dataset subsets": "dataset_processing/freqDiff_freqBias.py",
+            "plmi": "dsm_creation/plmi.py",
+            "measure weedsprec": "measures/weedsPrec.py",
+            "measure invcl": "measures/invCL.py",
+            "measure slqsrow": "measures/slqsRow.py",
+            "measure slqs": "measures/slqs.py",
+            "pipeline": "pipeline.py",
+            "evaluate": "evaluation/evaluation.py",
+            "classify": "evaluation/classification.py"}
+
+
+def main():
+    args = docopt(USAGE, options_first=True)
+
+    # commands of a group (e.g. dsm create) take the first argument as subcommand
+    command = args['<command>']
+    rest = args['<args>']
+    if command not in COMMANDS and rest and command + " " + rest[0] in COMMANDS:
+        command = command + " " + rest[0]
+        rest = rest[1:]
+    if command not in COMMANDS:
+        sys.exit(USAGE)
+
+    run_script(COMMANDS[command], rest)
+
+
+def run_script(script: str, argv: list):
+    """
+    Import a script and run its main() with the given arguments, as if it was run with python
+    The script is imported as a module of its own name, so that the functions its workers run can be pickled
+    :param script: the script relative to the directory of this file
+    :param argv: the arguments of the script
+    """
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), script)
+    # the directory of the script comes first, like for python <script>, the scripts import their neighbours by name
+    sys.path.insert(0, os.path.dirname(path))
+    sys.argv = [path] + argv
+    module = importlib.import_module(os.path.splitext(os.path.basename(path))[0])
+    module.main()
+
+
+if __name__ == '__main__':
+    main()
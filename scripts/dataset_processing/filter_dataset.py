@@ -1,6 +1,11 @@
 import pickle
+import os
+import sys
 from tqdm import tqdm
 from docopt import docopt
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from sparse_dsm import read_row_sums
+from artifacts import Stage
 
 
 def main():
@@ -12,17 +17,18 @@ def main():
     
     
     Usage:
-        filter_dataset.py <input_file_dataset> <rowSums_file> <output_file_dataset> [-s <output_file_dataset_compound> <output_file_dataset_nonCompound>]
+        filter_dataset.py <input_file_dataset> <rowSums_file> <output_file_dataset> [-s <output_file_dataset_compound> <output_file_dataset_nonCompound>] [--cached]
         
     Arguments:
         <input_file_dataset> = file containing the data set (pickled)
-        <rowSums_file> = file containing the row sums of the corpus (pickled)
+        <rowSums_file> = file containing the row sums of the corpus (pickled), or the DSM file/directory if its marginals were saved with it
         <output_file_dataset> = file to save the pickled data set
         <output_file_dataset_compound> = file to save the pickled compound-pairs
         <output_file_dataset_nonCompound> = file to save the pickled non-compound-pairs
         
     Options:
         -s --split  split dataset into compound-pairs and non-compound-pairs
+        --cached  skip if the outputs were saved by a run with the same arguments and inputs, see artifacts.py
     
     """)
 
@@ -34,8 +40,14 @@ def main():
     output_file_dataset_nonCompound = args['<output_file_dataset_nonCompound>']
     is_split = args['--split']
 
+    stage = Stage("filter_dataset", args, ['<input_file_dataset>', '<rowSums_file>'],
+                  [output_file_dataset, output_file_dataset_compound, output_file_dataset_nonCompound])
+    if stage.up_to_date():
+        print("Outputs are up to date, skipped")
+        return
+
     print("Loading row sums...")
-    rowSums = read_from_pickle(rowSums_file)
+    rowSums = read_row_sums(rowSums_file)
     print("Loaded row sums")
     print("Loading data set...")
     dataset = read_from_pickle(input_file_dataset)
@@ -55,6 +67,7 @@ def main():
         save_to_pickle(compounds, output_file_dataset_compound)
         save_to_pickle(nonCompounds, output_file_dataset_nonCompound)
         print("Saved")
+    stage.done()
 
 
 def relevant_pairs(wordPairs: set, rowSums):
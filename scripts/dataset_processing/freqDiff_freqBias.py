@@ -1,10 +1,14 @@
 import pickle
+import os
+import sys
 import time
 from tqdm import tqdm
 from collections import OrderedDict
 from operator import itemgetter
 import random
 from docopt import docopt
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from artifacts import Stage
 
 def main():
     args = docopt("""Create 
@@ -14,7 +18,7 @@ def main():
     and save as pickle files
     
     Usage:
-        freqDiff_freqBias.py <results_freq> <dataset_file> <N_subsets> <output_directory_freqDiff> <output_directory_freqBias>
+        freqDiff_freqBias.py <results_freq> <dataset_file> <N_subsets> <output_directory_freqDiff> <output_directory_freqBias> [--cached]
         
     Arguments:
         <results_freq> = pickled word frequency results
@@ -22,6 +26,9 @@ def main():
         <N_subsets> = number of subsets to create
         <output_directory_freqDiff> = directory to save pickled subsets sorted after relative frequency difference
         <output_directory_freqBias> = directory to save pickled subsets with different frequency biases
+
+    Options:
+        --cached  skip if the outputs were saved by a run with the same arguments and inputs, see artifacts.py
     
     """)
 
@@ -32,6 +39,12 @@ def main():
     output_directory_freqDiff = args['<output_directory_freqDiff>']
     output_directory_freqBias = args['<output_directory_freqBias>']
 
+    stage = Stage("freqDiff_freqBias", args, ['<results_freq>', '<dataset_file>'],
+                  [output_directory_freqDiff, output_directory_freqBias])
+    if stage.up_to_date():
+        print("Outputs are up to date, skipped")
+        return
+
     freqBias = FreqBias(results_freq, dataset_file)
     print("Creating subsets (frequency difference)...")
     subDicts = freqBias.divide(N_subsets)
@@ -71,6 +84,7 @@ def main():
         filenameSet = str(output_directory_freqBias) + "/freqBias" + str(i*10) + ".p"
         save_to_pickle(biasSet, filenameSet)
     print("Created subsets (frequency bias) and saved")
+    stage.done()
 
 
 class FreqBias:
@@ -1,13 +1,17 @@
 import pickle
+import os
+import sys
 from tqdm import tqdm
 from docopt import docopt
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from artifacts import Stage
 
 
 def main():
     args = docopt("""Read a data set and save pairs as set of tuples (noun1 n, noun2 n), duplicates and autohypernyms are excluded
     
     Usage:
-        read_dataset.py <input_file_dataset> (-g | -n | -w) <output_file_dataset> | <input_file_dataset> <input_file_dataset2> -e <output_file_dataset>
+        read_dataset.py <input_file_dataset> (-g | -n | -w) <output_file_dataset> [--cached] | <input_file_dataset> <input_file_dataset2> -e <output_file_dataset> [--cached]
         
     Arguments:
         <input_file_dataset> = file containing the data set (.txt)
@@ -19,6 +23,7 @@ def main():
         -n --ghostnn  read GhostNN
         -e --english  read english standard data set (e.g. BLESS, EVALution, Lenci/Benotto, Weeds)
         -w --wordnet  read WordNet
+        --cached  skip if the outputs were saved by a run with the same arguments and inputs, see artifacts.py
     
     """)
 
@@ -31,6 +36,11 @@ def main():
     is_english = args['--english']
     is_wordnet = args['--wordnet']
 
+    stage = Stage("read_dataset", args, ['<input_file_dataset>', '<input_file_dataset2>'], [output_file_dataset])
+    if stage.up_to_date():
+        print("Outputs are up to date, skipped")
+        return
+
     if is_germanet:
         print("Reading data set...")
         dataset = readGermaNet(input_file_dataset)
@@ -58,6 +68,7 @@ def main():
         print(len(dataset))
         save_to_pickle(dataset, output_file_dataset)
         print("Data set saved")
+    stage.done()
 
 
 def readGermaNet(germaNet: str):
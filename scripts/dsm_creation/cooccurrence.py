@@ -0,0 +1,512 @@
+import os
+import shutil
+import sys
+import numpy as np
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import tempfile
+from sparse_dsm import SparseDSM, SparseDSMWriter, ArrayWriter, reduce_counts, save_run, load_run, merge_runs, combine_sparse
+
+# ID of lemmas that are neither targets nor contexts (<unknown> lemmas in dewac)
+UNKNOWN = -1
+# UNKNOWN in the uint32 token array of a CorpusCache
+CACHE_UNKNOWN = np.iinfo(np.uint32).max
+
+
+class Vocabulary:
+
+    def __init__(self, ignoreUnknown: bool, targets: set = None, words: list = None):
+        """
+
+        :param ignoreUnknown: if True, <unknown> lemmas get the ID UNKNOWN (dewac)
+        :param targets: optional set of words, see target_mask()
+        :param words: optional list of known lemmas, their IDs are their positions
+        """
+        self.words = list(words) if words is not None else []
+        self.index = {word: i for i, word in enumerate(self.words)}
+        self.ignoreUnknown = ignoreUnknown
+        self.targets = targets
+        self.targetMask = np.zeros(0, dtype=bool)
+
+    def ids(self, sentence: list):
+        """
+        Map the lemmas of a sentence to integer IDs, new lemmas get the next free ID (order of first occurrence)
+        The lemmas are looked up in one pass, only if a lemma is missing the new lemmas of the sentence are added first
+        :param sentence: list of lemmas
+        :return: array of IDs
+        """
+        index = self.index
+        try:
+            return np.fromiter(map(index.__getitem__, sentence), dtype=np.int64, count=len(sentence))
+        except KeyError:
+            pass
+        for lemma in dict.fromkeys(sentence):
+            if lemma in index:
+                continue
+            if self.ignoreUnknown and lemma.startswith("<unknown>"):
+                index[lemma] = UNKNOWN
+            else:
+                index[lemma] = len(self.words)
+                self.words.append(lemma)
+        return np.fromiter(map(index.__getitem__, sentence), dtype=np.int64, count=len(sentence))
+
+    def target_mask(self):
+        """
+        Mark the IDs of the target words
+        :return: boolean array, True for the IDs of words in targets
+        """
+        if len(self.targetMask) < len(self.words):
+            newWords = self.words[len(self.targetMask):]
+            self.targetMask = np.concatenate((self.targetMask, [word in self.targets for word in newWords]))
+        return self.targetMask
+
+
+class CooccurrenceCounter:
+
+    def __init__(self, windowSize: int, batchSize: int = 1000000, memoryBudget: int = None, directory: str = None,
+                 targetMask=None, minDistance: int = 1, symmetric: bool = False):
+        """
+
+        :param windowSize: the window size
+        :param batchSize: number of tokens buffered before the co-occurrences of the buffered sentences are counted
+        :param memoryBudget: approximate number of bytes for the counts, when exceeded the counts are spilled to disk
+        :param directory: directory for the spilled runs and the merged DSM (with memoryBudget)
+        :param targetMask: optional function returning a boolean array over all IDs,
+        only co-occurrences of marked targets are counted, the row sums of all targets are kept as totals
+        :param minDistance: only contexts at least minDistance words away from the target are counted
+        :param symmetric: if True, every pair is counted once for the upper triangle (see symmetric_window_keys),
+        not together with targetMask
+        """
+        self.windowSize = windowSize
+        self.minDistance = minDistance
+        self.symmetric = symmetric
+        self.targetMask = targetMask
+        self.totals = np.zeros(0, dtype=np.int64)
+        self.batchSize = batchSize
+        self.memoryBudget = memoryBudget
+        self.directory = directory
+        # prefixes of the runs spilled to disk
+        self.runFiles = []
+        # buffered sentences as lists of IDs
+        self.sentences = []
+        self.buffered = 0
+        # sorted runs of (keys, counts), key = target ID << 32 | context ID
+        self.runs = []
+        self.frequency = np.zeros(0, dtype=np.int64)
+        # True for the IDs whose rows have counts, see targets()
+        self.counted = np.zeros(0, dtype=bool)
+
+    def add(self, ids):
+        """
+        Add a sentence, the co-occurrences are counted once the buffer is full
+        :param ids: the IDs of the lemmas of the sentence (array or list)
+        """
+        self.sentences.append(ids)
+        self.buffered += len(ids)
+        if self.buffered >= self.batchSize:
+            self.flush()
+
+    def flush(self):
+        """
+        Count the co-occurrences and word frequencies of all buffered sentences
+        """
+        if self.buffered == 0:
+            self.sentences = []
+            return
+        lengths = np.fromiter((len(sentence) for sentence in self.sentences), dtype=np.int64,
+                              count=len(self.sentences))
+        tokens = np.concatenate(self.sentences).astype(np.int64, copy=False)
+        self.sentences = []
+        self.buffered = 0
+        self.add_batch(tokens, lengths)
+
+    def add_batch(self, tokens, lengths):
+        """
+        Count the co-occurrences and word frequencies of a batch of sentences given as arrays
+        :param tokens: IDs of the tokens of all sentences, UNKNOWN for ignored lemmas
+        :param lengths: lengths of the sentences
+        """
+        self.frequency = add_counts(self.frequency, tokens[tokens >= 0])
+        if self.symmetric:
+            keys = symmetric_window_keys(tokens, lengths, self.windowSize, self.minDistance)
+        else:
+            keys = window_keys(tokens, lengths, self.windowSize, self.minDistance)
+        if self.targetMask is not None:
+            rows = keys >> 32
+            self.totals = add_counts(self.totals, rows)
+            keys = keys[self.targetMask()[rows]]
+        keys, counts = np.unique(keys, return_counts=True)
+        self.mark_rows(keys)
+        self.add_run(keys, counts.astype(np.int64))
+
+    def mark_rows(self, keys):
+        """
+        Mark the rows of new counts, in a symmetric count the contexts get the mirrored counts in their rows
+        :param keys: the keys of the counts
+        """
+        if len(keys) == 0:
+            return
+        ids = np.concatenate((keys >> 32, keys & 0xFFFFFFFF)) if self.symmetric else keys >> 32
+        size = int(ids.max()) + 1
+        if len(self.counted) < size:
+            self.counted = np.concatenate((self.counted, np.zeros(size - len(self.counted), dtype=bool)))
+        self.counted[ids] = True
+
+    def targets(self):
+        """
+        Number of distinct targets counted so far, i.e. the rows of the DSM that have counts
+        :return: the number of targets
+        """
+        return int(np.count_nonzero(self.counted))
+
+    def add_run(self, keys, counts):
+        """
+        Add a sorted run of counts, runs of similar size are merged so that only few runs are kept
+        :param keys: sorted unique keys
+        :param counts: counts aligned with the keys
+        """
+        self.runs.append((keys, counts))
+        while len(self.runs) > 1 and 2 * len(self.runs[-1][0]) >= len(self.runs[-2][0]):
+            keys2, counts2 = self.runs.pop()
+            keys1, counts1 = self.runs.pop()
+            self.runs.append(reduce_counts(np.concatenate((keys1, keys2)), np.concatenate((counts1, counts2))))
+        # a key and a count take 16 bytes
+        if self.memoryBudget is not None and 16 * sum(len(run[0]) for run in self.runs) > self.memoryBudget:
+            self.spill()
+
+    def spill(self):
+        """
+        Merge the runs in memory and save them as one sorted run file
+        """
+        keys, counts = self.merge()
+        self.runs = []
+        if len(keys) > 0:
+            self.runFiles.append(save_run(keys, counts, os.path.join(self.directory, "run" + str(len(self.runFiles)))))
+
+    def keep_runs(self, directory: str):
+        """
+        Merge the runs in memory and move the spilled runs to directory, so that the counter can be pickled
+        as a checkpoint and be continued later
+        :param directory: the directory for the spilled runs
+        """
+        self.flush()
+        self.merge()
+        os.makedirs(directory, exist_ok=True)
+        for i, runFile in enumerate(self.runFiles):
+            keptFile = os.path.join(directory, os.path.basename(runFile))
+            if runFile != keptFile:
+                for suffix in (".keys.npy", ".counts.npy"):
+                    shutil.move(runFile + suffix, keptFile + suffix)
+                self.runFiles[i] = keptFile
+
+    def resume(self, directory: str):
+        """
+        Continue counting with a counter restored from a checkpoint
+        :param directory: directory for new spilled runs and the merged DSM (with memoryBudget)
+        """
+        self.directory = directory
+
+    def merge(self):
+        """
+        Merge the runs in memory
+        :return: sorted unique keys, counts
+        """
+        if not self.runs:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        keys, counts = self.runs[0]
+        for keys2, counts2 in self.runs[1:]:
+            keys, counts = reduce_counts(np.concatenate((keys, keys2)), np.concatenate((counts, counts2)))
+        self.runs = [(keys, counts)]
+
+        return keys, counts
+
+    def entries(self):
+        """
+        Number of counted cells in the runs in memory and on disk, a cell in several runs is counted once per run
+        :return: the number of entries, an upper bound of the nonzero cells of the DSM
+        """
+        entries = sum(len(keys) for keys, counts in self.runs)
+        for runFile in self.runFiles:
+            entries += len(np.load(runFile + ".keys.npy", mmap_mode="r"))
+        return entries
+
+    def space(self, vocabulary: Vocabulary):
+        """
+        Build the DSM and word frequency counts
+        If counts were spilled to disk, the runs are merged with a k-way merge into directory/dsm
+        and the returned DSM is memory-mapped from there
+        :param vocabulary: the vocabulary used for the IDs
+        :return: SparseDSM, word frequency
+        """
+        self.flush()
+        words = vocabulary.words
+        wordFrequency = dict(zip(words, add_counts(self.frequency, np.zeros(0, dtype=np.int64), len(words)).tolist()))
+        totals = None
+        if self.targetMask is not None:
+            totals = add_counts(self.totals, np.zeros(0, dtype=np.int64), len(words))
+
+        if not self.runFiles:
+            keys, counts = self.merge()
+            dsm = SparseDSM.from_keys(list(words), len(words), keys, counts, self.symmetric)
+            dsm.totals = totals
+            return dsm, wordFrequency
+
+        self.spill()
+        writer = SparseDSMWriter(os.path.join(self.directory, "dsm"), words, len(words), totals, self.symmetric)
+        merge_runs([load_run(runFile) for runFile in self.runFiles], writer, max(1, self.memoryBudget // 16))
+        writer.close()
+
+        return SparseDSM.load(os.path.join(self.directory, "dsm"), mmap=True), wordFrequency
+
+
+class WindowCounters(CooccurrenceCounter):
+
+    def __init__(self, windowSizes: list, batchSize: int = 1000000, memoryBudget: int = None, directory: str = None,
+                 targetMask=None, symmetric: bool = False):
+        """
+        Counts the co-occurrences for several window sizes in one pass, with one CooccurrenceCounter
+        per bucket of distances between two window sizes, the DSMs are the cumulative sums of the buckets
+        :param windowSizes: sorted window sizes
+        :param batchSize: number of tokens buffered before the co-occurrences of the buffered sentences are counted
+        :param memoryBudget: approximate number of bytes for the counts of all buckets
+        :param directory: directory for the spilled runs and the merged DSMs (with memoryBudget)
+        :param targetMask: see CooccurrenceCounter
+        :param symmetric: see CooccurrenceCounter
+        """
+        # the sentences are buffered here and counted by the buckets
+        super().__init__(windowSizes[-1], batchSize)
+        self.memoryBudget = memoryBudget
+        self.directory = directory
+        bucketBudget = memoryBudget // len(windowSizes) if memoryBudget is not None else None
+        self.counters = []
+        for minDistance, windowSize in zip([1] + [size + 1 for size in windowSizes], windowSizes):
+            bucketDirectory = tempfile.mkdtemp(dir=directory) if memoryBudget is not None else None
+            self.counters.append(CooccurrenceCounter(windowSize, batchSize, bucketBudget, bucketDirectory,
+                                                     targetMask, minDistance, symmetric))
+
+    def add_batch(self, tokens, lengths):
+        for counter in self.counters:
+            counter.add_batch(tokens, lengths)
+
+    def keep_runs(self, directory: str):
+        self.flush()
+        for i, counter in enumerate(self.counters):
+            counter.keep_runs(os.path.join(directory, "bucket" + str(i)))
+
+    def resume(self, directory: str):
+        self.directory = directory
+        for counter in self.counters:
+            counter.resume(tempfile.mkdtemp(dir=directory) if self.memoryBudget is not None else None)
+
+    def entries(self):
+        return sum(counter.entries() for counter in self.counters)
+
+    def targets(self):
+        # the rows of the largest window size, a row has counts if it has counts in any bucket
+        counted = np.zeros(max(len(counter.counted) for counter in self.counters), dtype=bool)
+        for counter in self.counters:
+            counted[:len(counter.counted)] |= counter.counted
+        return int(np.count_nonzero(counted))
+
+    def space(self, vocabulary: Vocabulary):
+        """
+        Build the DSMs of all window sizes and the word frequency counts
+        :param vocabulary: the vocabulary used for the IDs
+        :return: list of SparseDSM (one per window size), word frequency
+        """
+        self.flush()
+        dsms = []
+        for counter in self.counters:
+            bucket, wordFrequency = counter.space(vocabulary)
+            if dsms:
+                # add the bucket to the DSM of the previous window size
+                directory = tempfile.mkdtemp(dir=self.directory) if self.memoryBudget is not None else None
+                bucket = combine_sparse([(dsms[-1], {}), (bucket, {})], directory, self.memoryBudget)[0]
+            dsms.append(bucket)
+
+        return dsms, wordFrequency
+
+
+class CorpusCache:
+
+    def __init__(self, directory: str):
+        """
+        A corpus pre-tokenized by write_cache(), the token IDs are memory-mapped
+        :param directory: the directory with vocab.txt, tokens.npy and offsets.npy
+        """
+        self.directory = directory
+        with open(os.path.join(directory, "vocab.txt"), encoding="utf-8") as vocabFile:
+            self.words = vocabFile.read().split("\n")[:-1]
+        self.tokens = np.load(os.path.join(directory, "tokens.npy"), mmap_mode="r")
+        # offsets[i] is the position of sentence i in tokens, offsets[-1] the number of tokens
+        self.offsets = np.load(os.path.join(directory, "offsets.npy"), mmap_mode="r")
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def vocabulary(self, targets: set = None):
+        """
+        Get the vocabulary of the token IDs
+        :param targets: optional set of words, see Vocabulary.target_mask()
+        :return: Vocabulary
+        """
+        return Vocabulary(False, targets, self.words)
+
+    def shards(self, workers: int):
+        """
+        Splits the corpus into ranges of sentences with about the same number of tokens
+        :param workers: number of shards
+        :return: list of (first, end) sentence indices
+        """
+        boundaries = np.searchsorted(self.offsets, [self.offsets[-1] * i // workers for i in range(workers)]).tolist()
+        boundaries.append(len(self))
+
+        return [(first, end) for first, end in zip(boundaries, boundaries[1:]) if first < end]
+
+    def batches(self, shard: tuple = None, batchSize: int = 1000000):
+        """
+        Reads the sentences in batches of whole sentences with about batchSize tokens
+        :param shard: optional (first, end) sentence indices
+        :param batchSize: number of tokens per batch
+        :return: generator of (token IDs, sentence lengths), UNKNOWN for <unknown> lemmas
+        """
+        first, end = shard if shard is not None else (0, len(self))
+        while first < end:
+            last = int(np.searchsorted(self.offsets, self.offsets[first] + batchSize, side="right")) - 1
+            last = min(end, max(first + 1, last))
+            tokens = self.tokens[self.offsets[first]:self.offsets[last]].astype(np.int64)
+            tokens[tokens == CACHE_UNKNOWN] = UNKNOWN
+            yield tokens, np.diff(self.offsets[first:last + 1])
+            first = last
+
+    def sentences(self, shard: tuple = None):
+        """
+        Reads the sentences as lists of lemmas
+        :param shard: optional (first, end) sentence indices
+        :return: generator of sentences as lists of lemmas
+        """
+        # UNKNOWN = -1 is the last entry
+        words = self.words + ["<unknown>"]
+        for tokens, lengths in self.batches(shard):
+            tokens = tokens.tolist()
+            start = 0
+            for length in lengths.tolist():
+                yield [words[i] for i in tokens[start:start + length]]
+                start += length
+
+
+def write_cache(sentences, directory: str, ignoreUnknown: bool, batchSize: int = 1000000):
+    """
+    Save a corpus as token IDs (uint32, tokens.npy), the start of each sentence (offsets.npy)
+    and the lemmas of the IDs (vocab.txt), to be read with CorpusCache
+    :param sentences: iterable of sentences, each a list of lemmas
+    :param directory: the directory
+    :param ignoreUnknown: if True, <unknown> lemmas are saved as CACHE_UNKNOWN (dewac)
+    :param batchSize: number of tokens buffered before they are written
+    """
+    os.makedirs(directory, exist_ok=True)
+    vocabulary = Vocabulary(ignoreUnknown)
+    tokens = ArrayWriter(os.path.join(directory, "tokens.npy"), np.uint32)
+    offsets = ArrayWriter(os.path.join(directory, "offsets.npy"), np.int64)
+    offsets.append([0])
+    bufferTokens = []
+    bufferOffsets = []
+    position = 0
+    buffered = 0
+    for sentence in sentences:
+        bufferTokens.append(vocabulary.ids(sentence))
+        buffered += len(sentence)
+        position += len(sentence)
+        bufferOffsets.append(position)
+        if buffered >= batchSize:
+            # UNKNOWN wraps around to CACHE_UNKNOWN
+            tokens.append(np.concatenate(bufferTokens).astype(np.uint32))
+            offsets.append(bufferOffsets)
+            bufferTokens = []
+            bufferOffsets = []
+            buffered = 0
+    tokens.append(np.concatenate(bufferTokens).astype(np.uint32) if bufferTokens else np.zeros(0, dtype=np.uint32))
+    offsets.append(bufferOffsets)
+    tokens.close()
+    offsets.close()
+    with open(os.path.join(directory, "vocab.txt"), "w", encoding="utf-8") as vocabFile:
+        for word in vocabulary.words:
+            vocabFile.write(word + "\n")
+
+
+def add_counts(counts, ids, size: int = 0):
+    """
+    Add the occurrences of IDs to an array of counts, the array grows with the IDs
+    :param counts: counts per ID
+    :param ids: the IDs to count
+    :param size: minimal length of the result
+    :return: the updated counts
+    """
+    added = np.bincount(ids, minlength=max(size, len(counts)))
+    added[:len(counts)] += counts
+    return added
+
+
+def window_keys(tokens, lengths, windowSize: int, minDistance: int = 1):
+    """
+    Generate the (target, context) pairs of all sentences of a batch with array offsets
+    The window of a target is centered on its index among the known lemmas of the sentence,
+    like the index in count_space, which is not increased for <unknown> lemmas
+    :param tokens: IDs of the tokens of all sentences, UNKNOWN for ignored lemmas
+    :param lengths: lengths of the sentences
+    :param windowSize: the window size
+    :param minDistance: the smallest distance between target and context
+    :return: keys (target ID << 32 | context ID), one per co-occurrence
+    """
+    starts = np.repeat(np.cumsum(lengths) - lengths, lengths)
+    ends = starts + np.repeat(lengths, lengths)
+    unknown = tokens < 0
+    # number of <unknown> lemmas before each token in its sentence
+    unknownBefore = np.cumsum(unknown) - unknown
+    unknownBefore -= unknownBefore[starts]
+    targets = np.flatnonzero(~unknown)
+    centers = targets - unknownBefore[targets]
+    starts = starts[targets]
+    ends = ends[targets]
+    targetKeys = tokens[targets] << 32
+
+    keys = [np.zeros(0, dtype=np.int64)]
+    for distance in range(minDistance, windowSize + 1):
+        for contexts in (centers - distance, centers + distance):
+            inWindow = (contexts >= starts) & (contexts < ends)
+            contextIds = tokens[contexts[inWindow]]
+            known = contextIds >= 0
+            keys.append(targetKeys[inWindow][known] | contextIds[known])
+
+    return np.concatenate(keys)
+
+
+def symmetric_window_keys(tokens, lengths, windowSize: int, minDistance: int = 1):
+    """
+    Generate every pair of lemmas within the window once, for a DSM storing only the upper triangle
+    The window is counted in positions of the sentence, so unlike window_keys it is not shifted
+    after <unknown> lemmas (dewac), without <unknown> lemmas both count the same co-occurrences
+    :param tokens: IDs of the tokens of all sentences, UNKNOWN for ignored lemmas
+    :param lengths: lengths of the sentences
+    :param windowSize: the window size
+    :param minDistance: the smallest distance between the two lemmas
+    :return: keys (smaller ID << 32 | larger ID), pairs of equal lemmas twice like in the full DSM
+    """
+    ends = np.repeat(np.cumsum(lengths), lengths)
+    targets = np.flatnonzero(tokens >= 0)
+    ends = ends[targets]
+    targetIds = tokens[targets]
+
+    keys = [np.zeros(0, dtype=np.int64)]
+    for distance in range(minDistance, windowSize + 1):
+        # only the context to the right, the left one is the mirrored pair
+        contexts = targets + distance
+        inWindow = contexts < ends
+        contextIds = tokens[contexts[inWindow]]
+        known = contextIds >= 0
+        first = targetIds[inWindow][known]
+        second = contextIds[known]
+        pairs = (np.minimum(first, second) << 32) | np.maximum(first, second)
+        keys.append(pairs)
+        keys.append(pairs[first == second])
+
+    return np.concatenate(keys)
@@ -0,0 +1,48 @@
+import os
+import sys
+from docopt import docopt
+from dsm_creation import german_sentences, english_sentences
+from cooccurrence import write_cache
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from artifacts import Stage
+
+
+def main():
+    args = docopt("""Convert a corpus into a pre-tokenized cache, that dsm_creation.py can read instead of the corpus
+
+    Usage:
+        corpus_cache.py (-g | -e) <corpus_file> <cache_dir> [--cached]
+
+    Arguments:
+        <corpus_file> = a directory path referring to the corpus file to be processed, either deWac or pUkWac
+        <cache_dir> = directory to save the lemmas (nouns, verbs and adjectives) as token IDs (tokens.npy), the sentence offsets (offsets.npy) and the vocabulary (vocab.txt)
+
+    Options:
+        -g --german  for German corpus
+        -e --english  for English corpus
+        --cached  skip if the outputs were saved by a run with the same arguments and inputs, see artifacts.py
+
+    """)
+
+    # get arguments and options
+    corpus_file = args['<corpus_file>']
+    cache_dir = args['<cache_dir>']
+    is_german = args['--german']
+
+    stage = Stage("corpus_cache", args, ['<corpus_file>'], [cache_dir])
+    if stage.up_to_date():
+        print("Outputs are up to date, skipped")
+        return
+
+    print("Processing corpus..")
+    if is_german:
+        # <unknown> lemmas are kept, they shift the window (see count_space)
+        write_cache(german_sentences(corpus_file), cache_dir, ignoreUnknown=True)
+    else:
+        write_cache(english_sentences(corpus_file), cache_dir, ignoreUnknown=False)
+    print("Cache saved")
+    stage.done()
+
+
+if __name__ == '__main__':
+    main()
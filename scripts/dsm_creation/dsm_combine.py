@@ -1,18 +1,34 @@
 import pickle
+import itertools
+import os
+import shutil
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from tqdm import tqdm
 from docopt import docopt
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from sparse_dsm import SparseDSM, combine_sparse, save_dict, save_marginals
+from artifacts import Stage
 
 
 def main():
     args = docopt("""Combine multiple DSM's and word frequencies and save them
     
     Usage:
-        dsm_combine.py <output_file_dsm> <output_file_freq> (<input_file>...)
+        dsm_combine.py <output_file_dsm> <output_file_freq> (<input_file>...) [-w <n>] [-m <mb>] [-t <dir>] [--cached]
         
     Arguments:
         <input_file> = pickled file storing the DSM and word frequencies as a tuple (dsm, wordFreq)
-        <output_file_dsm> = file to save the pickled DSM
+        <output_file_dsm> = file to save the pickled DSM (directory if the inputs contain SparseDSM's)
         <output_file_freq> = file to save the pickled word frequencies
+
+    Options:
+        -w --workers=<n>  number of processes combining pairs of inputs in parallel, level by level like a binary tree [default: 1]
+        -m --memory-budget=<mb>  approximate memory for the counts in MB, the inputs are sorted one at a time into runs on disk and k-way merged
+        -t --tmp=<dir>  directory for the saved inputs, the merged runs and the combined pairs (default: system temp directory)
+        --cached  skip if the outputs were saved by a run with the same arguments and inputs, see artifacts.py
         
     """)
 
@@ -20,35 +36,199 @@ def main():
     input_files = args['<input_file>']
     output_file_dsm = args['<output_file_dsm>']
     output_file_freq = args['<output_file_freq>']
+    workers = int(args['--workers'])
+    memory_budget = args['--memory-budget']
+    tmp = args['--tmp']
+
+    stage = Stage("dsm_combine", args, ['<input_file>'], [output_file_dsm, output_file_freq],
+                  ignore=('--workers', '--memory-budget', '--tmp'))
+    if stage.up_to_date():
+        print("Outputs are up to date, skipped")
+        return
 
-    loaded_input_files = []
-    print("Loading files...")
-    for input_file in tqdm(input_files):
-        tuple = read_from_pickle(input_file)
-        loaded_input_files.append(tuple)
-    print("Loaded files")
+    spill_directory = None
+    if memory_budget or workers > 1:
+        spill_directory = tempfile.mkdtemp(prefix="dsm_combine_", dir=tmp)
+    if memory_budget:
+        memory_budget = int(float(memory_budget) * 1024 * 1024)
 
+    # the input files are loaded one at a time while they are combined
     print("Combining...")
-    dsmCombined, wordFreqCombined = combine_spaces(loaded_input_files)
+    if workers > 1:
+        dsmCombined, wordFreqCombined = tree_combine(input_files, spill_directory, workers, memory_budget)
+    elif memory_budget:
+        dsmCombined, wordFreqCombined = merge_spaces(input_files, spill_directory, memory_budget)
+    else:
+        dsmCombined, wordFreqCombined = combine_spaces(read_spaces(input_files))
     print("Combined")
 
-    save_to_pickle(dsmCombined, output_file_dsm)
+    if isinstance(dsmCombined, SparseDSM):
+        dsmCombined.save(output_file_dsm)
+    else:
+        save_to_pickle(dsmCombined, output_file_dsm)
     save_to_pickle(wordFreqCombined, output_file_freq)
+    save_marginals(dsmCombined, wordFreqCombined, output_file_dsm)
     print("Saved")
 
+    if spill_directory:
+        shutil.rmtree(spill_directory)
+    stage.done()
+
+
+def read_spaces(inputFiles: list):
+    """
+    Read the (dsm, word frequency) tuples one at a time
+    :param inputFiles: the pickle files, or directories of pairs combined by combine_pair()
+    :return: generator of tuples (dsm, word frequency)
+    """
+    for inputFile in tqdm(inputFiles):
+        yield read_space(inputFile)
+
+
+def read_space(file: str):
+    """
+    Read a (dsm, word frequency) tuple, either pickled or saved by combine_pair() as a SparseDSM directory with the
+    pickled word frequencies (frequency.p), the SparseDSM is memory-mapped
+    :param file: the pickle file or directory
+    :return: dsm, word frequency
+    """
+    if os.path.isdir(file):
+        return SparseDSM.load(file, mmap=True), read_from_pickle(os.path.join(file, "frequency.p"))
+    return read_from_pickle(file)
+
+
+def merge_spaces(inputFiles: list, directory: str, memoryBudget: int):
+    """
+    Combine the (dsm, word frequency) tuples with a k-way merge, see merge_sparse()
+    :param inputFiles: the pickle files, or directories of pairs combined by combine_pair()
+    :param directory: directory for the saved inputs, the runs and the result
+    :param memoryBudget: memory budget in bytes for the counts
+    :return: dsm, word frequency (a dict DSM if the inputs contain dicts, a memory-mapped SparseDSM otherwise)
+    """
+    dsm, wordFrequencyCombine, containsDicts = merge_sparse(inputFiles, directory, memoryBudget)
+    if containsDicts:
+        return dsm.to_dict(), wordFrequencyCombine
+    return dsm, wordFrequencyCombine
+
+
+def merge_sparse(inputFiles: list, directory: str, memoryBudget: int):
+    """
+    Combine the (dsm, word frequency) tuples with a k-way merge into a memory-mapped SparseDSM, the inputs are read
+    one at a time, sorted into runs in directory and released (a dict DSM is first saved as a SparseDSM in directory
+    and memory-mapped), so that only one input is in memory at a time
+    :param inputFiles: the pickle files, or directories of pairs combined by combine_pair()
+    :param directory: directory for the saved inputs, the runs and the result
+    :param memoryBudget: memory budget in bytes for the counts
+    :return: SparseDSM, word frequency, True if the inputs contain dicts
+    """
+    containsDicts = []
+
+    def spaces():
+        for i, (dsm, wordFrequency) in enumerate(read_spaces(inputFiles)):
+            if isinstance(dsm, SparseDSM):
+                if os.path.exists(os.path.join(inputFiles[i], "dict")):
+                    containsDicts.append(True)
+                yield dsm, wordFrequency
+                continue
+            containsDicts.append(True)
+            partDirectory = os.path.join(directory, "part" + str(i))
+            save_dict(dsm, partDirectory)
+            # only the memory-mapped copy is kept until the input is sorted into runs
+            del dsm
+            yield SparseDSM.load(partDirectory, mmap=True), wordFrequency
+            shutil.rmtree(partDirectory)
+
+    dsm, wordFrequencyCombine = combine_sparse(spaces(), tempfile.mkdtemp(dir=directory), memoryBudget)
+    return dsm, wordFrequencyCombine, bool(containsDicts)
+
+
+def tree_combine(inputFiles: list, directory: str, workers: int, memoryBudget: int = None):
+    """
+    Combine the pickled (dsm, word frequency) tuples pairwise in a process pool, level by level like a binary tree,
+    neighbouring parts are combined so that the result is identical to combine_spaces over all parts in order
+    :param inputFiles: the pickle files
+    :param directory: directory for the combined pairs of each level
+    :param workers: number of processes
+    :param memoryBudget: optional memory budget in bytes for each pair, see merge_spaces()
+    :return: dsm, word frequency (a memory-mapped SparseDSM with memoryBudget, unless the inputs contain dicts)
+    """
+    files = list(inputFiles)
+    level = 0
+    # unlike a Pool, the executor fails when a worker dies (e.g. killed for lack of memory) instead of waiting forever
+    with ProcessPoolExecutor(workers) as executor:
+        while len(files) > 1:
+            print("Combining " + str(len(files)) + " parts (level " + str(level) + ")...")
+            jobs = [(files[i:i + 2], os.path.join(directory, "level" + str(level) + "_" + str(i // 2)), memoryBudget)
+                    for i in range(0, len(files), 2)]
+            try:
+                combined = list(tqdm(executor.map(combine_pair, jobs), total=len(jobs)))
+            except BrokenProcessPool as error:
+                raise RuntimeError("a process combining a pair of parts died") from error
+            # the pairs of the previous level are not needed anymore
+            for file in files:
+                if file not in inputFiles and file not in combined:
+                    remove_space(file)
+            files = combined
+            level += 1
+
+    dsm, wordFrequency = read_space(files[0])
+    if os.path.exists(os.path.join(files[0], "dict")):
+        return dsm.to_dict(), wordFrequency
+    return dsm, wordFrequency
+
+
+def combine_pair(job: tuple):
+    """
+    Combine two (dsm, word frequency) tuples and save the result, runs in a worker process
+    Without a memory budget, the result is pickled to <output>.p. With a memory budget, the memory-mapped result is
+    moved to the directory <output> with the pickled word frequencies (and an empty file "dict" if the inputs
+    contain dicts), so that it is not read into memory to be returned
+    :param job: tuple (list of one or two input files, output file without extension, memory budget or None)
+    :return: the file or directory of the combined tuple (the input file if there is only one)
+    """
+    inputFiles, output, memoryBudget = job
+    if len(inputFiles) == 1:
+        return inputFiles[0]
+    if memoryBudget is None:
+        save_to_pickle(combine_spaces(read_space(inputFile) for inputFile in inputFiles), output + ".p")
+        return output + ".p"
+    directory = tempfile.mkdtemp(dir=os.path.dirname(output))
+    dsm, wordFrequency, containsDicts = merge_sparse(inputFiles, directory, memoryBudget)
+    os.replace(dsm.directory, output)
+    save_to_pickle(wordFrequency, os.path.join(output, "frequency.p"))
+    if containsDicts:
+        open(os.path.join(output, "dict"), "w").close()
+    shutil.rmtree(directory)
+    return output
+
+
+def remove_space(file: str):
+    """
+    Remove a combined pair saved by combine_pair()
+    :param file: the pickle file or directory
+    """
+    if os.path.isdir(file):
+        shutil.rmtree(file)
+    else:
+        os.remove(file)
+
 
 def combine_spaces(spaces: list):
     """
     Combine multiple DSM's and word frequency counts into one DSM
-    :param spaces: list containing tuples of (dsm, word frequency)
+    :param spaces: list or iterator yielding tuples of (dsm, word frequency)
     :return: dsm, word frequency
     """
+    spaces = iter(spaces)
     # set first dsm and word frequency counts as versions to be contain combinations
-    spaceCombine = spaces[0]
+    spaceCombine = next(spaces)
+    # SparseDSM's are combined on their arrays
+    if isinstance(spaceCombine[0], SparseDSM):
+        return combine_sparse(itertools.chain([spaceCombine], tqdm(spaces)))
     dsmCombine = spaceCombine[0]
     wordFrequencyCombine = spaceCombine[1]
     # combine all DSM's and word frequency counts into one
-    for space in tqdm(spaces[1:]):
+    for space in tqdm(spaces):
         dsm = space[0]
         wordFrequency = space[1]
 
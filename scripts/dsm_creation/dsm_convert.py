@@ -0,0 +1,59 @@
+import pickle
+import os
+import sys
+from docopt import docopt
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from sparse_dsm import save_dict, save_marginals
+from artifacts import Stage
+
+
+def main():
+    args = docopt("""Convert a pickled DSM into a SparseDSM directory, whose rows are read from disk only when they are accessed
+
+    Usage:
+        dsm_convert.py <dsm_file> <output_dir_dsm> [<freq_file>] [--cached]
+
+    Arguments:
+        <dsm_file> = file containing the pickled DSM as dict[target:dict[context:co-occurrence count]]
+        <output_dir_dsm> = directory to save the SparseDSM, accepted as <dsm_file> by all following scripts
+        <freq_file> = file containing the pickled word frequencies, if given the marginals are saved with the DSM (see rowSums.py)
+
+    Options:
+        --cached  skip if the outputs were saved by a run with the same arguments and inputs, see artifacts.py
+
+    """)
+
+    # get arguments
+    dsm_file = args['<dsm_file>']
+    output_dir_dsm = args['<output_dir_dsm>']
+    freq_file = args['<freq_file>']
+
+    stage = Stage("dsm_convert", args, ['<dsm_file>', '<freq_file>'], [output_dir_dsm])
+    if stage.up_to_date():
+        print("Outputs are up to date, skipped")
+        return
+
+    print("Loading DSM...")
+    dsm = read_from_pickle(dsm_file)
+    print("Loaded DSM")
+
+    print("Saving DSM...")
+    save_dict(dsm, output_dir_dsm)
+    if freq_file:
+        save_marginals(dsm, read_from_pickle(freq_file), output_dir_dsm)
+    print("Saved")
+    stage.done()
+
+
+def read_from_pickle(file: str):
+    """
+    this function reads an object from a pickle file and returns it
+    :param file: the file containing the object
+    :return obj: the object
+    """
+    obj = pickle.load(open(file, "rb"))
+    return obj
+
+
+if __name__ == '__main__':
+    main()
@@ -2,32 +2,62 @@ import pickle
 from tqdm import tqdm
 from docopt import docopt
 import gzip
+import itertools
+import locale
+import os
+import shutil
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dsm_combine import combine_spaces
+from cooccurrence import CooccurrenceCounter, CorpusCache, Vocabulary, WindowCounters, write_cache
+from telemetry import Telemetry
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from sparse_dsm import SparseDSM, combine_sparse, restrict_rows, row_contexts, save_marginals
+from artifacts import Stage
 
 
 def main():
     args = docopt("""Create DSM for a corpus and save it along with word frequencies
-    
+
     Usage:
-        dsm_creation.py (-g | -e) <corpus_file> <window_size> (-s <output_file_dsm> <output_file_freq> | -c <output_file_tuple>)
-        
+        dsm_creation.py (-g | -e) <corpus_file> <window_size> (-s <output_file_dsm> <output_file_freq> | -c <output_file_tuple>) [-w <n>] [--sparse [-b <tokens>] [-m <mb> [-t <dir>]] [--symmetric] [(-d <dataset_file>)... [--targets-only]]] [-k <dir> [--checkpoint-every=<sentences>] [--resume]] [--metrics=<file> [--metrics-every=<seconds>]] [--cached]
+
     Arguments:
-        <corpus_file> = a directory path referring to the corpus file to be processed, either deWac or pUkWac
-        <window_size> = the window size for co-occurrence counting
-        <output_file_dsm> = file to save the pickled DSM
+        <corpus_file> = a directory path referring to the corpus file to be processed, either deWac or pUkWac, or a cache directory created with corpus_cache.py
+        <window_size> = the window size for co-occurrence counting, or several comma-separated window sizes (e.g. 2,5,10) counted in one pass
+        <output_file_dsm> = file to save the pickled DSM (directory with --sparse), with several window sizes "{}" is replaced by the window size (or it is appended)
         <output_file_freq> = file to save the pickled word frequencies
-        <output_file_tuple> = file to save the pickled tuple (dsm, wordFreq)
-        
+        <output_file_tuple> = file to save the pickled tuple (dsm, wordFreq), with several window sizes like <output_file_dsm>
+        <dataset_file> = pickled set of word pairs (see read_dataset.py or filter_dataset.py), the DSM is restricted to their words
+
     Options:
         -g --german  for German corpus
         -e --english  for English corpus
         -s --single  if corpus is in a single file
         -c --combine  if this is just a part of the corpus, that needs to be combined with the other parts later
-        
+        -w --workers=<n>  number of processes counting sentence-aligned corpus shards in parallel [default: 1], a gzipped corpus (pukwac) is first cached in one pass like with corpus_cache.py (in the checkpoint directory, or a temporary directory) and the cache is split
+        --sparse  count with integer IDs on arrays and save the DSM as CSR arrays (see sparse_dsm.py) instead of dict[dict]
+        -b --batch=<tokens>  number of tokens buffered before their co-occurrences are counted (with --sparse) [default: 1000000]
+        -m --memory-budget=<mb>  approximate memory for the counts in MB (per worker), partial counts are spilled to disk as sorted runs and k-way merged at the end (with --sparse)
+        -t --tmp=<dir>  directory for the spilled runs (default: system temp directory)
+        --symmetric  count every pair of lemmas once and save only the upper triangle, rows are mirrored when read, in dewac the window is not shifted after <unknown> lemmas (with --sparse, not with --targets-only)
+        -d --dataset=<dataset_file>  keep only the rows of the data set words and of their contexts (needed by slqs), the row sums of all words are saved as rowsums.npy (with --sparse), the contexts are only known after counting, so all rows are counted and the other rows are dropped when the DSM is saved (only the output is smaller, see --targets-only)
+        --targets-only  keep only the rows of the data set words and count only their co-occurrences, smallest DSM but not enough for slqs (with --sparse)
+        -k --checkpoint=<dir>  save the partial counts to this directory regularly (per worker), removed when the DSM is saved
+        --checkpoint-every=<sentences>  number of sentences between two checkpoints [default: 1000000]
+        --resume  continue from the checkpoint in the checkpoint directory after an interruption, with the same arguments
+        --metrics=<file>  append throughput and memory metrics of the corpus pass to this JSON-lines file (one record per worker)
+        --metrics-every=<seconds>  number of seconds between two records [default: 60]
+        --cached  skip if the outputs were saved by a run with the same arguments and inputs, see artifacts.py
+
     """)
 
     # get arguments and options
     corpus_file = args['<corpus_file>']
-    window_size = int(args['<window_size>'])
+    window_sizes = sorted(set(int(size) for size in args['<window_size>'].split(",")))
+    window_size = window_sizes if len(window_sizes) > 1 else window_sizes[0]
     output_file_dsm = args['<output_file_dsm>']
     output_file_freq = args['<output_file_freq>']
     output_file_tuple = args['<output_file_tuple>']
@@ -35,208 +65,739 @@ def main():
     is_english = args['--english']
     is_single = args['--single']
     is_combine = args['--combine']
-
+    workers = int(args['--workers'])
+    is_sparse = args['--sparse']
+    batch_size = int(args['--batch'])
+    memory_budget = args['--memory-budget']
+    tmp = args['--tmp']
+    dataset_files = args['--dataset']
+    targets_only = args['--targets-only']
+    is_symmetric = args['--symmetric']
+    checkpoint_dir = args['--checkpoint']
+    checkpoint_every = int(args['--checkpoint-every'])
+    resume = args['--resume']
+    metrics_file = args['--metrics']
+    metrics_every = float(args['--metrics-every'])
+    if is_symmetric and targets_only:
+        # only the rows of the targets are counted, their mirrored cells would be missing from the rows of the contexts
+        raise ValueError("--symmetric can not be combined with --targets-only")
+
+    # one DSM (or tuple) per window size, the options of the counting do not change the outputs
+    if is_single:
+        output_files = [window_file(output_file_dsm, size, window_sizes) for size in window_sizes] + [output_file_freq]
+    else:
+        output_files = [window_file(output_file_tuple, size, window_sizes) for size in window_sizes]
+    stage = Stage("dsm_creation", args, ['<corpus_file>', '--dataset'], output_files,
+                  ignore=('<output_file_dsm>', '<output_file_tuple>', '--workers', '--batch', '--memory-budget', '--tmp',
+                          '--checkpoint', '--checkpoint-every', '--resume', '--metrics', '--metrics-every'))
+    if stage.up_to_date():
+        print("Outputs are up to date, skipped")
+        return
+
+    # directory for the spilled runs, removed when the DSM is saved
+    spill_directory = None
+    if memory_budget:
+        memory_budget = int(float(memory_budget) * 1024 * 1024)
+        spill_directory = tempfile.mkdtemp(prefix="dsm_creation_", dir=tmp)
+    # words of the data sets the DSM is restricted to
+    targets = None
+    if dataset_files:
+        targets = set()
+        for dataset_file in dataset_files:
+            for pair in read_from_pickle(dataset_file):
+                targets.update(pair)
+    # count on arrays for the sparse DSM or several window sizes, with dicts otherwise
+    if is_sparse or len(window_sizes) > 1:
+        count = SparseCount(batch_size, memory_budget, spill_directory, targets, targets_only, is_symmetric)
+    else:
+        count = count_space
+
+    # partial counts are only continued with the same arguments
+    checkpoint = None
+    if checkpoint_dir:
+        key = (os.path.abspath(corpus_file), window_sizes, is_german, count is count_space, targets_only, is_symmetric,
+               sorted(targets) if targets is not None else None)
+        checkpoint = Checkpoint(checkpoint_dir, checkpoint_every, resume, key)
+
+    telemetry = Telemetry(metrics_file, metrics_every) if metrics_file else None
+
+    print("Processing corpus..")
     if is_german:
-        print("Processing corpus..")
-        dsm, wordFreq = semantic_space_german(corpus_file, window_size)
-        print("Corpus processed")
-        if is_single:
-            save_to_pickle(dsm, output_file_dsm)
-            save_to_pickle(wordFreq, output_file_freq)
-            print("DSM saved, Word Frequency saved")
-        if is_combine:
-            save_to_pickle((dsm, wordFreq), output_file_tuple)
-            print("(DSM, Word Frequency) saved, needs to be combined with other parts")
+        dsm, wordFreq = semantic_space_german(corpus_file, window_size, workers, count, checkpoint, telemetry)
     if is_english:
-        print("Processing corpus..")
-        dsm, wordFreq = semantic_space_english(corpus_file, window_size)
-        print("Corpus processed")
+        dsm, wordFreq = semantic_space_english(corpus_file, window_size, workers, count, checkpoint, telemetry)
+    print("Corpus processed")
+
+    # one DSM per window size
+    dsms = dsm if len(window_sizes) > 1 else [dsm]
+    for window_size, dsm in zip(window_sizes, dsms):
+        # the rows of the contexts are only known after combining the parts, parts are not restricted further
+        if targets is not None and is_single:
+            dsm = count.restrict(dsm)
+        if isinstance(dsm, SparseDSM) and not is_sparse:
+            dsm = dsm.to_dict()
         if is_single:
-            save_to_pickle(dsm, output_file_dsm)
-            save_to_pickle(wordFreq, output_file_freq)
-            print("DSM saved, Word Frequency saved")
+            save_dsm(dsm, window_file(output_file_dsm, window_size, window_sizes))
+            # row sums, word frequencies and sample size next to the DSM, read by rowSums.py, plmi.py and the measures
+            save_marginals(dsm, wordFreq, window_file(output_file_dsm, window_size, window_sizes))
+            print("DSM saved (window size " + str(window_size) + ")")
         if is_combine:
-            save_to_pickle((dsm, wordFreq), output_file_tuple)
-            print("(DSM, Word Frequency) saved, needs to be combined with other parts")
+            save_to_pickle((dsm, wordFreq), window_file(output_file_tuple, window_size, window_sizes))
+            print("(DSM, Word Frequency) saved (window size " + str(window_size) + "), needs to be combined with other parts")
+    if is_single:
+        save_to_pickle(wordFreq, output_file_freq)
+        print("Word Frequency saved")
+
+    if spill_directory:
+        shutil.rmtree(spill_directory)
+    if checkpoint_dir:
+        shutil.rmtree(checkpoint_dir)
+    stage.done()
 
 
-def semantic_space_german(corpus: str, windowSize: int):
+def semantic_space_german(corpus: str, windowSize, workers: int = 1, count=None, checkpoint=None, telemetry=None):
     """
     Computes the DSM and word frequency counts from a corpus file for German (dewac)
     :param corpus: the corpus file (.txt) (dewac)
-    :param windowSize: the window size
+    :param windowSize: the window size, or a list of window sizes (with SparseCount)
+    :param workers: number of processes counting corpus shards in parallel
+    :param count: function counting a stream of sentences, count_space (default) or SparseCount
+    :param checkpoint: optional Checkpoint to save the partial counts to and to continue from
+    :param telemetry: optional Telemetry to write the metrics of the pass to
     :return: dsm, word frequency
     """
-    with open(corpus) as corpus:
-        dsm = {}
-        wordFrequency = {}
-        # checks if the sentence is complete
-        sentenceComplete = False
-        # store sentence as a list
-        sentence = []
-
-        # only go one time through the corpus, read one word at a time, total as estimate for tqdm bar
-        for word in tqdm(corpus, total=1196895401):
-            word = word.strip()
-
-            # "<s>" marks the beginning of a sentence, set sentence empty, sentence is not complete
-            if word == "<s>":
-                sentence = []
-                sentenceComplete = False
-
-            # "</s>" marks the end of a sentence, sentence is complete
-            if word == "</s>":
-                sentenceComplete = True
-
-            # first column: word, second column: tag, third column: lemma
-            word = word.split("\t")
-
-            # add lemma with pos-tag to the sentence, only take into account nouns verbs and adjectives
-            if (len(word) >= 3) and (word[1].startswith("N") or word[1].startswith("V") or word[1].startswith("ADJ")):
-                lemma = word[2] + " " + word[1][0].lower()
-                sentence.append(lemma)
-
-            if sentenceComplete:
-
-                # keep track of the index of the current word
-                wordIndex = 0
-                # go through the sentence word by word
-                for lemma in sentence:
-                    # ignore <unknown> lemmas, they should not be in the dsm
-                    if lemma.startswith("<unknown>"):
-                        continue
-                    # if lemma not in word frequency dict, add and set count to 1
-                    if lemma not in wordFrequency:
-                        wordFrequency[lemma] = 1
-                    # if lemma already in word frequency dict, add 1 to its count
-                    else:
-                        wordFrequency[lemma] += 1
-
-                    # if lemma not yet in dsm, add it with an empty dictionary
-                    if lemma not in dsm:
-                        dsm[lemma] = {}
-
-                    # keep track of the window size, should not start with the current lemma itself
-                    tempIndex = wordIndex - 1
-                    # check if tempIndex is within the window size and max. the beginning of the sentence
-                    while (tempIndex >= 0 and wordIndex - tempIndex <= windowSize):
-                        # avoid adding <unknown> lemmas to the DSM
-                        if not sentence[tempIndex].startswith("<unknown>"):
-                            # check if lemma already has an entry for this word
-                            if not dsm.get(lemma).get(sentence[tempIndex]):
-                                # if not, add it and set it to 1
-                                dsm[lemma][sentence[tempIndex]] = 1
-                            # if yes, add 1 to its count
-                            else:
-                                dsm[lemma][sentence[tempIndex]] += 1
-
-                        # one word to the left
-                        tempIndex -= 1
-
-                    # same as above, but to the right of the current lemma
-                    tempIndex = wordIndex + 1
-                    while (tempIndex < len(sentence) and tempIndex - wordIndex <= windowSize):
-                        if not sentence[tempIndex].startswith("<unknown>"):
-                            if not dsm.get(lemma).get(sentence[tempIndex]):
-                                dsm[lemma][sentence[tempIndex]] = 1
-                            else:
-                                dsm[lemma][sentence[tempIndex]] += 1
-
-                        tempIndex += 1
-
-                    # update word index for next iteration
-                    wordIndex += 1
-
-                sentenceComplete = False
-
-    return dsm, wordFrequency
-
-
-def semantic_space_english(corpusPath: str, windowSize: int):
+    count = count or count_space
+    if os.path.isdir(corpus):
+        return cache_space(corpus, windowSize, True, workers, count, checkpoint, telemetry)
+    if workers > 1:
+        return parallel_space(corpus, windowSize, True, german_shards(corpus, workers), count, checkpoint, telemetry)
+    skip = checkpoint.load() if checkpoint is not None else 0
+    # ignore <unknown> lemmas, they should not be in the dsm
+    return count(german_sentences(corpus, skip=skip, telemetry=telemetry), windowSize, ignoreUnknown=True,
+                 checkpoint=checkpoint, telemetry=telemetry)
+
+
+def semantic_space_english(corpusPath: str, windowSize, workers: int = 1, count=None, checkpoint=None,
+                           telemetry=None):
     """
     Computes the DSM and word frequency counts from a corpus file for English (pukwac)
     :param corpusPath: the corpus file (.gz) (pukwac)
+    :param windowSize: the window size, or a list of window sizes (with SparseCount)
+    :param workers: number of processes counting corpus shards in parallel
+    :param count: function counting a stream of sentences, count_space (default) or SparseCount
+    :param checkpoint: optional Checkpoint to save the partial counts to and to continue from
+    :param telemetry: optional Telemetry to write the metrics of the pass to
+    :return: dsm, word frequency
+    """
+    count = count or count_space
+    if os.path.isdir(corpusPath):
+        return cache_space(corpusPath, windowSize, False, workers, count, checkpoint, telemetry)
+    if workers > 1:
+        # a gzipped corpus can not be split, every worker would decompress it from the beginning up to its shard
+        cacheDirectory = english_cache(corpusPath, checkpoint)
+        try:
+            return cache_space(cacheDirectory, windowSize, False, workers, count, checkpoint, telemetry)
+        finally:
+            if checkpoint is None:
+                shutil.rmtree(cacheDirectory)
+    skip = checkpoint.load() if checkpoint is not None else 0
+    return count(english_sentences(corpusPath, skip=skip, telemetry=telemetry), windowSize, ignoreUnknown=False,
+                 checkpoint=checkpoint, telemetry=telemetry)
+
+
+def count_space(sentences, windowSize: int, ignoreUnknown: bool, checkpoint=None, telemetry=None):
+    """
+    Counts co-occurrences and word frequencies for a stream of sentences
+    :param sentences: iterable of sentences, each a list of lemmas
     :param windowSize: the window size
+    :param ignoreUnknown: if True, <unknown> lemmas are neither targets nor contexts (dewac)
+    :param checkpoint: optional Checkpoint, sentences counted before the checkpoint are not contained in sentences
+    :param telemetry: optional Telemetry to write the metrics of the pass to
     :return: dsm, word frequency
     """
     dsm = {}
     wordFrequency = {}
-    with gzip.open(corpusPath, "rt", encoding="latin1") as corpus:
-        # checks if the sentence is complete
-        sentenceComplete = False
-        # store sentence as a list
-        sentence = []
-
-        # only go one time through the corpus, read one word at a time, total as estimate for tqdm bar
-        for word in tqdm(corpus, total=500000000):
-            word = word.strip()
-
-            # "<s>" marks the beginning of a sentence, set sentence empty, sentence is not complete
-            if word == "<s>":
-                sentence = []
-                sentenceComplete = False
-
-            # "</s>" marks the end of a sentence, sentence is complete
-            if word == "</s>":
-                sentenceComplete = True
-
-            # first column: word, second column: tag, third column: lemma
-            word = word.split("\t")
-
-            # add lemma with pos-tag to the sentence, only take into account nouns verbs and adjectives
-            if (len(word) >= 3) and (word[2].startswith("N") or word[2].startswith("V") or word[2].startswith("J")):
-                lemma = word[1] + " " + word[2][0].lower()
-                sentence.append(lemma)
-
-            if sentenceComplete:
-
-                # keep track of the index of the current word
-                wordIndex = 0
-                # go through the sentence word by word
-                for lemma in sentence:
-                    # if lemma not in word frequency dict, add and set count to 1
-                    if lemma not in wordFrequency:
-                        wordFrequency[lemma] = 1
-                    # if lemma already in word frequency dict, add 1 to its count
+    # continue with the counts of the checkpoint
+    if checkpoint is not None and checkpoint.state is not None:
+        dsm, wordFrequency = checkpoint.state
+    for sentence in sentences:
+        # keep track of the index of the current word
+        wordIndex = 0
+        # go through the sentence word by word
+        for lemma in sentence:
+            # ignore <unknown> lemmas, they should not be in the dsm
+            if ignoreUnknown and lemma.startswith("<unknown>"):
+                continue
+            # if lemma not in word frequency dict, add and set count to 1
+            if lemma not in wordFrequency:
+                wordFrequency[lemma] = 1
+            # if lemma already in word frequency dict, add 1 to its count
+            else:
+                wordFrequency[lemma] += 1
+
+            # if lemma not yet in dsm, add it with an empty dictionary
+            if lemma not in dsm:
+                dsm[lemma] = {}
+
+            # keep track of the window size, should not start with the current lemma itself
+            tempIndex = wordIndex - 1
+            # check if tempIndex is within the window size and max. the beginning of the sentence
+            while (tempIndex >= 0 and wordIndex - tempIndex <= windowSize):
+                # avoid adding <unknown> lemmas to the DSM
+                if not (ignoreUnknown and sentence[tempIndex].startswith("<unknown>")):
+                    # check if lemma already has an entry for this word
+                    if not dsm.get(lemma).get(sentence[tempIndex]):
+                        # if not, add it and set it to 1
+                        dsm[lemma][sentence[tempIndex]] = 1
+                    # if yes, add 1 to its count
                     else:
-                        wordFrequency[lemma] += 1
-
-                    # if lemma not yet in dsm, add it with an empty dictionary
-                    if lemma not in dsm:
-                        dsm[lemma] = {}
-
-                    # keep track of the window size, should not start with the current lemma itself
-                    tempIndex = wordIndex - 1
-                    # check if tempIndex is within the window size and max. the beginning of the sentence
-                    while (tempIndex >= 0 and wordIndex - tempIndex <= windowSize):
-                        # check if lemma already has an entry for this word
-                        if not dsm.get(lemma).get(sentence[tempIndex]):
-                            # if not, add it and set it to 1
-                            dsm[lemma][sentence[tempIndex]] = 1
-                        # if yes, add 1 to its entry
-                        else:
-                            dsm[lemma][sentence[tempIndex]] += 1
-
-                        # one word to the left
-                        tempIndex -= 1
-
-                    # same as above, but to the right of the current lemma
-                    tempIndex = wordIndex + 1
-                    while (tempIndex < len(sentence) and tempIndex - wordIndex <= windowSize):
-                        if not dsm.get(lemma).get(sentence[tempIndex]):
-                            dsm[lemma][sentence[tempIndex]] = 1
-                        else:
-                            dsm[lemma][sentence[tempIndex]] += 1
-
-                        tempIndex += 1
-
-                    # update word index for next iteration
-                    wordIndex += 1
-
-                sentenceComplete = False
+                        dsm[lemma][sentence[tempIndex]] += 1
+
+                # one word to the left
+                tempIndex -= 1
+
+            # same as above, but to the right of the current lemma
+            tempIndex = wordIndex + 1
+            while (tempIndex < len(sentence) and tempIndex - wordIndex <= windowSize):
+                if not (ignoreUnknown and sentence[tempIndex].startswith("<unknown>")):
+                    if not dsm.get(lemma).get(sentence[tempIndex]):
+                        dsm[lemma][sentence[tempIndex]] = 1
+                    else:
+                        dsm[lemma][sentence[tempIndex]] += 1
+
+                tempIndex += 1
+
+            # update word index for next iteration
+            wordIndex += 1
+
+        if checkpoint is not None and checkpoint.due():
+            checkpoint.save((dsm, wordFrequency))
+        if telemetry is not None:
+            telemetry.add(len(sentence))
+            if telemetry.due():
+                # like with --sparse, only the rows with counts are targets
+                telemetry.emit(sum(1 for contexts in dsm.values() if contexts),
+                               sum(len(contexts) for contexts in dsm.values()))
+    if checkpoint is not None:
+        checkpoint.save((dsm, wordFrequency))
+    if telemetry is not None:
+        telemetry.emit(sum(1 for contexts in dsm.values() if contexts),
+                       sum(len(contexts) for contexts in dsm.values()), final=True)
+
     return dsm, wordFrequency
 
 
+class SparseCount:
+
+    def __init__(self, batchSize: int = 1000000, memoryBudget: int = None, directory: str = None,
+                 targets: set = None, targetsOnly: bool = False, symmetric: bool = False):
+        """
+        Counts co-occurrences on integer IDs with CooccurrenceCounter, can be used in place of count_space
+        :param batchSize: number of tokens buffered before their co-occurrences are counted
+        :param memoryBudget: approximate number of bytes for the counts, when exceeded the counts are spilled to disk
+        :param directory: directory for the spilled runs (with memoryBudget)
+        :param targets: optional set of words the DSM is restricted to, see restrict()
+        :param targetsOnly: if True, only the co-occurrences of the targets are counted
+        :param symmetric: if True, only the upper triangle is counted (not together with targetsOnly, rejected by main)
+        """
+        self.batchSize = batchSize
+        self.memoryBudget = memoryBudget
+        self.directory = directory
+        self.targets = targets
+        self.targetsOnly = targetsOnly
+        self.symmetric = symmetric
+
+    def __call__(self, sentences, windowSize, ignoreUnknown: bool, checkpoint=None, telemetry=None):
+        """
+        Counts co-occurrences and word frequencies for a stream of sentences
+        :param sentences: iterable of sentences, each a list of lemmas
+        :param windowSize: the window size, or a list of window sizes
+        :param ignoreUnknown: if True, <unknown> lemmas are neither targets nor contexts (dewac)
+        :param checkpoint: optional Checkpoint, sentences counted before the checkpoint are not contained in sentences
+        :param telemetry: optional Telemetry to write the metrics of the pass to
+        :return: SparseDSM, word frequency, or list of SparseDSM (one per window size), word frequency
+        """
+        vocabulary, counter = self.start(Vocabulary(ignoreUnknown, self.targets), windowSize, checkpoint)
+        for sentence in sentences:
+            counter.add(vocabulary.ids(sentence))
+            if checkpoint is not None and checkpoint.due():
+                self.save_checkpoint(checkpoint, vocabulary, counter)
+            if telemetry is not None:
+                telemetry.add(len(sentence))
+                if telemetry.due():
+                    telemetry.emit(counter.targets(), counter.entries())
+        if checkpoint is not None:
+            self.save_checkpoint(checkpoint, vocabulary, counter)
+        if telemetry is not None:
+            counter.flush()
+            telemetry.emit(counter.targets(), counter.entries(), final=True)
+
+        return counter.space(vocabulary)
+
+    def count_cache(self, cache: CorpusCache, windowSize, shard: tuple = None, checkpoint=None, telemetry=None):
+        """
+        Counts co-occurrences and word frequencies directly on the token IDs of a pre-tokenized corpus
+        :param cache: the CorpusCache
+        :param windowSize: the window size, or a list of window sizes
+        :param shard: optional (first, end) sentence indices
+        :param checkpoint: optional Checkpoint, sentences counted before the checkpoint are not contained in shard
+        :param telemetry: optional Telemetry to write the metrics of the pass to
+        :return: SparseDSM, word frequency, or list of SparseDSM (one per window size), word frequency
+        """
+        vocabulary, counter = self.start(cache.vocabulary(self.targets), windowSize, checkpoint)
+        for tokens, lengths in cache.batches(shard, self.batchSize):
+            # counted before the batch, so that the time of the first batch is included in the rates
+            if telemetry is not None:
+                telemetry.add(len(tokens), len(lengths))
+            counter.add_batch(tokens, lengths)
+            if checkpoint is not None and checkpoint.due(len(lengths)):
+                self.save_checkpoint(checkpoint, vocabulary, counter)
+            if telemetry is not None and telemetry.due():
+                telemetry.emit(counter.targets(), counter.entries())
+        if checkpoint is not None:
+            self.save_checkpoint(checkpoint, vocabulary, counter)
+        if telemetry is not None:
+            counter.flush()
+            telemetry.emit(counter.targets(), counter.entries(), final=True)
+
+        return counter.space(vocabulary)
+
+    def start(self, vocabulary: Vocabulary, windowSize, checkpoint=None):
+        """
+        Create a CooccurrenceCounter for one pass through the corpus or a shard,
+        or restore the vocabulary and the counter of a checkpoint
+        :param vocabulary: the vocabulary of the IDs
+        :param windowSize: the window size, or a list of window sizes
+        :param checkpoint: optional Checkpoint
+        :return: vocabulary, CooccurrenceCounter (WindowCounters for a list of window sizes)
+        """
+        # every call (e.g. one per shard) spills into its own directory
+        directory = tempfile.mkdtemp(dir=self.directory) if self.memoryBudget is not None else None
+        if checkpoint is not None and checkpoint.state is not None:
+            vocabulary, counter = checkpoint.state
+            counter.resume(directory)
+            return vocabulary, counter
+        # the row sums of the other words are still counted, they are needed for the marginals
+        targetMask = vocabulary.target_mask if self.targetsOnly else None
+        if isinstance(windowSize, list):
+            return vocabulary, WindowCounters(windowSize, self.batchSize, self.memoryBudget, directory, targetMask,
+                                              self.symmetric)
+        return vocabulary, CooccurrenceCounter(windowSize, self.batchSize, self.memoryBudget, directory, targetMask,
+                                               symmetric=self.symmetric)
+
+    def save_checkpoint(self, checkpoint, vocabulary: Vocabulary, counter: CooccurrenceCounter):
+        """
+        Save the vocabulary and the counter, the spilled runs are moved to the checkpoint
+        :param checkpoint: the Checkpoint
+        :param vocabulary: the vocabulary of the IDs
+        :param counter: the counter
+        """
+        counter.keep_runs(os.path.join(checkpoint.directory, "runs"))
+        checkpoint.save((vocabulary, counter))
+
+    def combine(self, spaces):
+        """
+        Combine the DSMs and word frequency counts of the shards, within the memory budget if one is set
+        :param spaces: iterator yielding tuples of (SparseDSM, word frequency), or of (list of SparseDSM, word frequency)
+        :return: SparseDSM, word frequency, or list of SparseDSM (one per window size), word frequency
+        """
+        spaces = iter(spaces)
+        first = next(spaces)
+        spaces = itertools.chain([first], spaces)
+        if isinstance(first[0], list):
+            # combine each window size on its own
+            spaces = list(spaces)
+            combined = [self.combine((dsms[i], wordFrequency) for dsms, wordFrequency in spaces)
+                        for i in range(len(first[0]))]
+            return [dsm for dsm, wordFrequency in combined], combined[0][1]
+        if self.memoryBudget is None:
+            return combine_sparse(spaces)
+        return combine_sparse(spaces, tempfile.mkdtemp(dir=self.directory), self.memoryBudget)
+
+    def restrict(self, dsm: SparseDSM):
+        """
+        Keep only the rows of the targets and, unless targetsOnly, the rows of their contexts,
+        the row sums of all words are kept as totals
+        :param dsm: the complete SparseDSM
+        :return: the restricted SparseDSM
+        """
+        words = set(self.targets)
+        if not self.targetsOnly:
+            words.update(row_contexts(dsm, self.targets))
+        if self.memoryBudget is None:
+            return restrict_rows(dsm, words)
+        return restrict_rows(dsm, words, tempfile.mkdtemp(dir=self.directory), self.memoryBudget)
+
+
+class Checkpoint:
+
+    def __init__(self, directory: str, every: int, resume: bool, key: tuple):
+        """
+        Saves the partial counts of a pass through the corpus together with the number of counted sentences,
+        so that an interrupted pass can be continued
+        :param directory: the directory of the checkpoint
+        :param every: number of sentences between two checkpoints
+        :param resume: if True, continue from the checkpoint in directory (if there is one)
+        :param key: the arguments of the pass, a checkpoint is only continued with the same arguments
+        """
+        self.directory = directory
+        self.every = every
+        self.resume = resume
+        self.key = key
+        # number of sentences counted so far and at the last checkpoint
+        self.sentences = 0
+        self.saved = 0
+        # the partial counts of the checkpoint
+        self.state = None
+
+    def shard(self, index: int, shard: tuple):
+        """
+        Get the checkpoint of a shard of the corpus
+        :param index: the index of the shard
+        :param shard: the shard
+        :return: Checkpoint
+        """
+        return Checkpoint(os.path.join(self.directory, "shard" + str(index)), self.every, self.resume, self.key + (shard,))
+
+    def load(self):
+        """
+        Load the saved partial counts into state, if resume is set and there is a checkpoint
+        :return: number of sentences counted before the checkpoint
+        """
+        file = os.path.join(self.directory, "checkpoint.p")
+        if self.resume and os.path.exists(file):
+            key, self.sentences, self.state = read_from_pickle(file)
+            if key != self.key:
+                raise ValueError("checkpoint " + file + " was saved with other arguments")
+            self.saved = self.sentences
+            print("Continuing after " + str(self.sentences) + " sentences")
+        elif os.path.exists(self.directory):
+            shutil.rmtree(self.directory)
+        os.makedirs(self.directory, exist_ok=True)
+        return self.sentences
+
+    def due(self, sentences: int = 1):
+        """
+        Count sentences and check whether the next checkpoint should be saved
+        :param sentences: number of sentences counted since the last call
+        :return: True if every sentences were counted since the last checkpoint
+        """
+        self.sentences += sentences
+        return self.sentences - self.saved >= self.every
+
+    def save(self, state):
+        """
+        Save the partial counts, the previous checkpoint is replaced only when the new one is complete
+        :param state: the partial counts
+        """
+        file = os.path.join(self.directory, "checkpoint.p")
+        save_to_pickle((self.key, self.sentences, state), file + ".tmp")
+        os.replace(file + ".tmp", file)
+        self.saved = self.sentences
+
+
+def german_sentences(corpus: str, shard: tuple = None, skip: int = 0, telemetry=None):
+    """
+    Reads the sentences of the German corpus (dewac)
+    :param corpus: the corpus file (.txt) (dewac)
+    :param shard: optional (start, end) byte offsets of a sentence-aligned part of the corpus
+    :param skip: number of sentences at the beginning that are skipped without parsing them
+    :param telemetry: optional Telemetry counting the lemmas dropped by the pos-tag filter
+    :return: generator of sentences as lists of lemmas (nouns, verbs and adjectives)
+    """
+    if shard is None:
+        with open(corpus) as lines:
+            # total as estimate for tqdm bar
+            yield from corpus_sentences(skip_sentences(tqdm(lines, total=1196895401), skip), 1, 2, ("N", "V", "ADJ"),
+                                        telemetry)
+    else:
+        lines = byte_shard_lines(corpus, shard, locale.getpreferredencoding(False))
+        yield from corpus_sentences(skip_sentences(lines, skip), 1, 2, ("N", "V", "ADJ"), telemetry)
+
+
+def english_sentences(corpusPath: str, skip: int = 0, telemetry=None):
+    """
+    Reads the sentences of the English corpus (pukwac), it is split into shards through a cache (see english_cache)
+    :param corpusPath: the corpus file (.gz) (pukwac)
+    :param skip: number of sentences at the beginning that are skipped without parsing them
+    :param telemetry: optional Telemetry counting the lemmas dropped by the pos-tag filter
+    :return: generator of sentences as lists of lemmas (nouns, verbs and adjectives)
+    """
+    with gzip.open(corpusPath, "rt", encoding="latin1") as lines:
+        # total as estimate for tqdm bar
+        yield from corpus_sentences(skip_sentences(tqdm(lines, total=500000000), skip), 2, 1, ("N", "V", "J"),
+                                    telemetry)
+
+
+def corpus_sentences(lines, tagIndex: int, lemmaIndex: int, tags: tuple, telemetry=None):
+    """
+    Groups the lines of a corpus into sentences, a sentence is yielded when it is complete
+    :param lines: the lines of the corpus, one word per line
+    :param tagIndex: column of the pos-tag
+    :param lemmaIndex: column of the lemma
+    :param tags: pos-tag prefixes of the words to keep
+    :param telemetry: optional Telemetry counting the words dropped by the pos-tag filter
+    :return: generator of sentences as lists of lemmas
+    """
+    # store sentence as a list
+    sentence = []
+
+    # only go one time through the corpus, read one word at a time
+    for word in lines:
+        word = word.strip()
+
+        # "<s>" marks the beginning of a sentence, set sentence empty
+        if word == "<s>":
+            sentence = []
+
+        # "</s>" marks the end of a sentence, sentence is complete
+        sentenceComplete = word == "</s>"
+
+        # first column: word, other columns: tag and lemma
+        word = word.split("\t")
+
+        # add lemma with pos-tag to the sentence, only take into account nouns verbs and adjectives
+        if (len(word) >= 3) and word[tagIndex].startswith(tags):
+            lemma = word[lemmaIndex] + " " + word[tagIndex][0].lower()
+            sentence.append(lemma)
+        elif telemetry is not None and len(word) >= 3:
+            telemetry.filtered += 1
+
+        if sentenceComplete:
+            yield sentence
+
+
+def skip_sentences(lines, sentences: int):
+    """
+    Skips the lines of the first sentences, each ends with a "</s>" line like in corpus_sentences
+    :param lines: the lines of the corpus
+    :param sentences: number of sentences to skip
+    :return: generator of the remaining lines
+    """
+    lines = iter(lines)
+    if sentences > 0:
+        for line in lines:
+            if line.strip() == "</s>":
+                sentences -= 1
+                if sentences == 0:
+                    break
+    yield from lines
+
+
+def german_shards(corpus: str, workers: int):
+    """
+    Splits the German corpus into byte ranges, each starting at a "<s>" line
+    :param corpus: the corpus file (.txt) (dewac)
+    :param workers: number of shards
+    :return: list of (start, end) byte offsets
+    """
+    size = os.path.getsize(corpus)
+    boundaries = [0]
+    with open(corpus, "rb") as lines:
+        for i in range(1, workers):
+            # jump to the estimated boundary and skip the (possibly partial) line
+            lines.seek(max(size * i // workers, boundaries[-1]))
+            lines.readline()
+            # move forward to the beginning of the next sentence
+            while True:
+                position = lines.tell()
+                line = lines.readline()
+                if not line:
+                    position = size
+                    break
+                if line.strip() == b"<s>":
+                    break
+            boundaries.append(position)
+    boundaries.append(size)
+
+    return [(start, end) for start, end in zip(boundaries, boundaries[1:]) if start < end]
+
+
+def english_cache(corpusPath: str, checkpoint=None):
+    """
+    Caches the English corpus in one pass (see corpus_cache.py), so that it can be split into shards,
+    the corpus is gzipped and can not be split by bytes
+    :param corpusPath: the corpus file (.gz) (pukwac)
+    :param checkpoint: optional Checkpoint, the cache is saved in its directory and reused when the pass is resumed
+    :return: the cache directory, a temporary directory without checkpoint
+    """
+    if checkpoint is None:
+        directory = tempfile.mkdtemp(prefix="corpus_cache_")
+    else:
+        directory = os.path.join(checkpoint.directory, "corpus")
+        # written last, marks a complete cache
+        if checkpoint.resume and os.path.exists(os.path.join(directory, "complete")):
+            return directory
+        if os.path.exists(directory):
+            shutil.rmtree(directory)
+    print("Caching corpus..")
+    write_cache(english_sentences(corpusPath), directory, ignoreUnknown=False)
+    open(os.path.join(directory, "complete"), "w").close()
+
+    return directory
+
+
+def byte_shard_lines(corpus: str, shard: tuple, encoding: str):
+    """
+    Reads the lines of a byte range of a corpus file
+    :param corpus: the corpus file
+    :param shard: (start, end) byte offsets, start is the beginning of a line
+    :param encoding: the encoding of the corpus file
+    :return: generator of lines
+    """
+    start, end = shard
+    with open(corpus, "rb") as lines:
+        lines.seek(start)
+        position = start
+        for line in lines:
+            if position >= end:
+                break
+            position += len(line)
+            yield line.decode(encoding)
+
+
+def cache_space(cacheDirectory: str, windowSize, ignoreUnknown: bool, workers: int, count, checkpoint=None,
+                telemetry=None):
+    """
+    Computes the DSM and word frequency counts from a corpus cache created with corpus_cache.py
+    :param cacheDirectory: the cache directory
+    :param windowSize: the window size, or a list of window sizes (with SparseCount)
+    :param ignoreUnknown: if True, <unknown> lemmas are neither targets nor contexts (dewac)
+    :param workers: number of processes counting corpus shards in parallel
+    :param count: function counting a stream of sentences, count_space or SparseCount
+    :param checkpoint: optional Checkpoint to save the partial counts to and to continue from
+    :param telemetry: optional Telemetry to write the metrics of the pass to
+    :return: dsm, word frequency
+    """
+    if workers > 1:
+        shards = CorpusCache(cacheDirectory).shards(workers)
+        return parallel_space(cacheDirectory, windowSize, ignoreUnknown, shards, count, checkpoint, telemetry)
+    return count_cache(cacheDirectory, windowSize, ignoreUnknown, count, checkpoint=checkpoint, telemetry=telemetry)
+
+
+def count_cache(cacheDirectory: str, windowSize, ignoreUnknown: bool, count, shard: tuple = None, checkpoint=None,
+                telemetry=None):
+    """
+    Computes the DSM and word frequency counts for a corpus cache or a shard of it
+    :param cacheDirectory: the cache directory
+    :param windowSize: the window size, or a list of window sizes (with SparseCount)
+    :param ignoreUnknown: if True, <unknown> lemmas are neither targets nor contexts (dewac)
+    :param count: function counting a stream of sentences, count_space or SparseCount
+    :param shard: optional (first, end) sentence indices
+    :param checkpoint: optional Checkpoint to save the partial counts to and to continue from
+    :param telemetry: optional Telemetry to write the metrics of the pass to
+    :return: dsm, word frequency
+    """
+    cache = CorpusCache(cacheDirectory)
+    first, end = shard if shard is not None else (0, len(cache))
+    if checkpoint is not None:
+        first += checkpoint.load()
+    if isinstance(count, SparseCount):
+        return count.count_cache(cache, windowSize, (first, end), checkpoint, telemetry)
+    return count(cache.sentences((first, end)), windowSize, ignoreUnknown, checkpoint, telemetry)
+
+
+def count_shard(job: tuple):
+    """
+    Computes the DSM and word frequency counts for one shard of a corpus, runs in a worker process
+    :param job: tuple (corpus file, window size, is German, shard, count function, checkpoint or None,
+    telemetry or None)
+    :return: dsm, word frequency
+    """
+    corpus, windowSize, isGerman, shard, count, checkpoint, telemetry = job
+    if os.path.isdir(corpus):
+        dsm, wordFrequency = count_cache(corpus, windowSize, isGerman, count, shard, checkpoint, telemetry)
+    else:
+        # only the German corpus is split by bytes, the English one through a cache
+        skip = checkpoint.load() if checkpoint is not None else 0
+        dsm, wordFrequency = count(german_sentences(corpus, shard, skip, telemetry), windowSize, ignoreUnknown=True,
+                                   checkpoint=checkpoint, telemetry=telemetry)
+    # a memory-mapped DSM is passed on as its directory instead of sending the arrays
+    if isinstance(dsm, list):
+        return [shared_dsm(part) for part in dsm], wordFrequency
+    return shared_dsm(dsm), wordFrequency
+
+
+def shared_dsm(dsm):
+    """
+    Replace a memory-mapped SparseDSM by its directory, to be loaded again with loaded_dsm()
+    :param dsm: the DSM
+    :return: the DSM or its directory
+    """
+    if isinstance(dsm, SparseDSM) and dsm.directory is not None:
+        return dsm.directory
+    return dsm
+
+
+def loaded_dsm(dsm):
+    """
+    Load a DSM passed on by shared_dsm()
+    :param dsm: the DSM or its directory
+    :return: the DSM
+    """
+    if isinstance(dsm, str):
+        return SparseDSM.load(dsm, mmap=True)
+    return dsm
+
+
+def parallel_space(corpus: str, windowSize, isGerman: bool, shards: list, count, checkpoint=None, telemetry=None):
+    """
+    Computes the DSM and word frequency counts with one process per shard and merges them in corpus order,
+    so that the result is identical to a single pass through the corpus
+    :param corpus: the corpus file
+    :param windowSize: the window size, or a list of window sizes (with SparseCount)
+    :param isGerman: True for dewac, False for pukwac
+    :param shards: the shards of the corpus
+    :param count: function counting a stream of sentences, count_space or SparseCount
+    :param checkpoint: optional Checkpoint, each shard saves its partial counts to its own checkpoint
+    :param telemetry: optional Telemetry, each shard writes its own records
+    :return: dsm, word frequency
+    """
+    jobs = [(corpus, windowSize, isGerman, shard, count, checkpoint.shard(i, shard) if checkpoint is not None else None,
+             telemetry.shard(i) if telemetry is not None else None)
+            for i, shard in enumerate(shards)]
+    print("Counting " + str(len(jobs)) + " shards..")
+    # unlike a Pool, the executor fails when a worker dies (e.g. killed for lack of memory) instead of waiting forever
+    with ProcessPoolExecutor(len(jobs)) as executor:
+        spaces = (([loaded_dsm(part) for part in dsm] if isinstance(dsm, list) else loaded_dsm(dsm), wordFrequency)
+                  for dsm, wordFrequency in executor.map(count_shard, jobs))
+        try:
+            if isinstance(count, SparseCount):
+                return count.combine(spaces)
+            return combine_spaces(spaces)
+        except BrokenProcessPool as error:
+            raise RuntimeError("a process counting a shard died, the counts saved with -k can be continued with "
+                               "--resume") from error
+
+
+def window_file(file: str, windowSize: int, windowSizes: list):
+    """
+    Get the output file for the DSM of one of several window sizes
+    :param file: the output file, "{}" is replaced by the window size
+    :param windowSize: the window size of the DSM
+    :param windowSizes: all window sizes
+    :return: the output file for the window size
+    """
+    if len(windowSizes) == 1:
+        return file
+    if "{}" in file:
+        return file.replace("{}", str(windowSize))
+    root, extension = os.path.splitext(file)
+    return root + "_" + str(windowSize) + extension
+
+
+def save_dsm(dsm, file: str):
+    """
+    this function saves a DSM, a SparseDSM as directory and a dict as pickle file
+    :param dsm: the DSM
+    :param file: the file or directory to save the DSM
+    """
+    if isinstance(dsm, SparseDSM):
+        dsm.save(file)
+    else:
+        save_to_pickle(dsm, file)
+
+
 def read_from_pickle(file: str):
     """
     this function reads an object from a pickle file and returns it
@@ -0,0 +1,66 @@
+import os
+import shutil
+import sys
+from docopt import docopt
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from sparse_dsm import read_dsm, read_row_sums, read_sample_size, share_dsm, shared_directory
+from artifacts import Stage
+
+
+def main():
+    args = docopt("""Place a DSM and its row sums in shared memory, so that the measures of several processes or users on the
+    same machine can attach to it with --shared=<name> instead of each reading its own copy
+
+    Usage:
+        dsm_share.py <dsm_file> <rowSums_file> <name> [--cached]
+        dsm_share.py --remove <name>
+
+    Arguments:
+        <dsm_file> = file containing the pickled DSM or directory containing the SparseDSM
+        <rowSums_file> = file containing the pickled row sums, or the DSM file/directory if its marginals were saved with it
+        <name> = name of the shared DSM, it is saved as a SparseDSM in /dev/shm/dsm_<name> and stays there until it is removed
+
+    Options:
+        --remove  remove the shared DSM and free its memory
+        --cached  skip if the outputs were saved by a run with the same arguments and inputs, see artifacts.py
+
+    """)
+
+    # get arguments and options
+    dsm_file = args['<dsm_file>']
+    rowSums_file = args['<rowSums_file>']
+    name = args['<name>']
+    directory = shared_directory(name)
+
+    if args['--remove']:
+        shutil.rmtree(directory)
+        if os.path.exists(directory + ".fingerprint"):
+            os.remove(directory + ".fingerprint")
+        print("Removed")
+        return
+
+    stage = Stage("dsm_share", args, ['<dsm_file>', '<rowSums_file>'], [directory])
+    if stage.up_to_date():
+        print("Outputs are up to date, skipped")
+        return
+
+    print("Loading DSM...")
+    dsm = read_dsm(dsm_file)
+    print("Loaded DSM")
+
+    print("Loading row sums...")
+    rowSums = read_row_sums(rowSums_file)
+    sampleSize = read_sample_size(rowSums_file)
+    print("Loaded row sums")
+
+    print("Sharing DSM...")
+    # a previous version is replaced, processes attached to it keep their mapping until they exit
+    if os.path.exists(directory):
+        shutil.rmtree(directory)
+    share_dsm(dsm, rowSums, directory, sampleSize)
+    print("Shared as " + directory + ", attach with --shared=" + name)
+    stage.done()
+
+
+if __name__ == '__main__':
+    main()
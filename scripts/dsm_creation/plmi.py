@@ -1,35 +1,62 @@
 import pickle
+import os
+import sys
 from tqdm import tqdm
 import math
+import numpy as np
 from docopt import docopt
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from sparse_dsm import SparseDSM, read_dsm, read_row_sums, read_sample_size, row_sums_array, shared_directory
+from artifacts import Stage
 
 
 def main():
     args = docopt("""Compute PLMI values for all targets and their contexts of used data sets and save as dict[dict]
     
     Usage:
-        plmi.py <dsm_file> <rowSums_file> <output_file_plmi> (<input_file_dataset>...)
+        plmi.py <dsm_file> <rowSums_file> <output_file_plmi> (<input_file_dataset>... | --all) [--sparse] [-n <top_N>] [--cached]
+        plmi.py --shared=<name> <output_file_plmi> (<input_file_dataset>... | --all) [--sparse] [-n <top_N>] [--cached]
         
     Arguments:
-        <dsm_file> = file containing the pickled DSM
-        <rowSums_file> = file containing the pickled row sums
-        <output_file_plmi> = file containing the plmi values as dict[target:dict[context:plmi]]
+        <dsm_file> = file containing the pickled DSM or directory containing the SparseDSM
+        <rowSums_file> = file containing the pickled row sums, or the DSM file/directory if its marginals were saved with it
+        <output_file_plmi> = file containing the plmi values as dict[target:dict[context:plmi]] (directory with --sparse)
         <input_file_dataset> = file containing the pickled filtered data set
+
+    Options:
+        --all  compute the plmi values of all targets, implies --sparse
+        --sparse  compute the plmi values of all rows at once with numpy and save them as SparseDSM directory, without the values that are 0
+        -n --top-n=<top_N>  keep only the top N contexts of each row, enough for slqs.py with the same or a smaller top_N, ties are taken in context ID order (see top_positions), implies --sparse
+        --shared=<name>  attach to the DSM and row sums placed in shared memory with dsm_share.py instead of reading them
+        --cached  skip if the outputs were saved by a run with the same arguments and inputs, see artifacts.py
     
     """)
 
+    if args['--shared']:
+        # the shared DSM contains the row sums
+        args['<dsm_file>'] = args['<rowSums_file>'] = shared_directory(args['--shared'])
+
     # get arguments
     dsm_file = args['<dsm_file>']
     rowSums_file = args['<rowSums_file>']
     output_file_plmi = args['<output_file_plmi>']
     input_file_dataset = args['<input_file_dataset>']
+    is_all = args['--all']
+    topN = int(args['--top-n']) if args['--top-n'] else None
+    is_sparse = args['--sparse'] or is_all or topN is not None
+
+    stage = Stage("plmi", args, ['<dsm_file>', '<rowSums_file>', '<input_file_dataset>'], [output_file_plmi])
+    if stage.up_to_date():
+        print("Outputs are up to date, skipped")
+        return
 
     print("Loading DSM...")
-    dsm = read_from_pickle(dsm_file)
+    dsm = read_dsm(dsm_file)
     print("Loaded DSM")
 
     print("Loading row sums...")
-    rowSums = read_from_pickle(rowSums_file)
+    rowSums = read_row_sums(rowSums_file, dsm)
+    sampleSize = read_sample_size(rowSums_file)
     print("Loaded row sums")
 
     print("Loading data set(s)...")
@@ -40,11 +67,21 @@ def main():
     print("Loaded data sets")
 
     print("Calculating PLMI values...")
-    dsmPLMI = dsm_plmi(pairs, dsm, rowSums)
+    if is_sparse:
+        words = None if is_all else {word for pair in pairs for word in pair}
+        dsmPLMI = sparse_plmi(dsm, rowSums, sampleSize, words, topN)
+    else:
+        dsmPLMI = dsm_plmi(pairs, dsm, rowSums, sampleSize)
     print("Calculated PLMI values")
 
-    save_to_pickle(dsmPLMI, output_file_plmi)
+    if is_sparse:
+        dsmPLMI.save(output_file_plmi)
+        if topN is not None:
+            np.save(os.path.join(output_file_plmi, "topn.npy"), np.int64(topN))
+    else:
+        save_to_pickle(dsmPLMI, output_file_plmi)
     print("Saved")
+    stage.done()
 
 
 def sample_size(rowSums: dict):
@@ -87,15 +124,17 @@ def plmi(dsm, target: str, context: str, sampleSize, rowSums: dict):
     return plmi
 
 
-def dsm_plmi(wordPairs: set, dsm, rowSums):
+def dsm_plmi(wordPairs: set, dsm, rowSums, sampleSize=None):
     """
     Compute plmi scores for words and save in DSM format
     :param wordPairs: a set of word pairs
     :param dsm: the DSM
     :param rowSums: the row sums
+    :param sampleSize: the sum of all row sums if known (see read_sample_size), computed from rowSums otherwise
     :return: DSM with plmi weighting (only for given words as targets)
     """
-    sampleSize = sample_size(rowSums)
+    if sampleSize is None:
+        sampleSize = sample_size(rowSums)
     dsmPLMI = {}
 
     for pair in tqdm(wordPairs):
@@ -126,6 +165,100 @@ def dsm_plmi(wordPairs: set, dsm, rowSums):
     return dsmPLMI
 
 
+def plmi_values(counts, targetTotals, contextTotals, sampleSize):
+    """
+    Compute plmi() for arrays of co-occurrence counts and the row sums of their targets and contexts
+    :param counts: co-occurrence counts
+    :param targetTotals: row sums of the targets (or the row sum of a single target)
+    :param contextTotals: row sums of the contexts
+    :param sampleSize: total sum of all row sums
+    :return: plmi values as array, 0 where the expected frequency is 0 or the plmi is negative
+    """
+    counts = np.asarray(counts, dtype=np.float64)
+    expectedFreqs = np.asarray(targetTotals, dtype=np.float64) * contextTotals / sampleSize
+    plmis = np.zeros(len(counts))
+    valid = (expectedFreqs > 0) & (counts > 0)
+    plmis[valid] = counts[valid] * np.log10(counts[valid] / expectedFreqs[valid])
+
+    return np.maximum(plmis, 0)
+
+
+def top_positions(plmis, topN: int):
+    """
+    Select the top N positive plmi values of a row, the values are only partitioned and not sorted
+    Ties at the cut are taken in row order, i.e. by context ID (the order in which the contexts first occur in the
+    corpus), like SLQS.top_N_contexts on a SparseDSM. A pickled dict DSM orders the contexts of a row by their first
+    co-occurrence with the target instead, so with ties at the cut, SLQS on plmi values of a dict can select other
+    contexts than on these
+    :param plmis: the plmi values of the row
+    :param topN: number of values to keep
+    :return: positions of the top N values in ascending order
+    """
+    positive = np.flatnonzero(plmis > 0)
+    if len(positive) <= topN:
+        return positive
+    if topN <= 0:
+        return positive[:0]
+    values = plmis[positive]
+    # the N-th largest value
+    threshold = np.partition(values, len(values) - topN)[len(values) - topN]
+    above = positive[values > threshold]
+    ties = positive[values == threshold][:topN - len(above)]
+
+    return np.sort(np.concatenate((above, ties)))
+
+
+def sparse_plmi(dsm, rowSums, sampleSize=None, words: set = None, topN: int = None, chunkSize: int = 1000000):
+    """
+    Compute the plmi values of the whole DSM, or of the rows of some targets, from the count arrays with numpy
+    The cells with plmi 0 are dropped, the other cells keep the order of the DSM
+    :param dsm: the DSM, a dict is converted to a SparseDSM
+    :param rowSums: the row sums
+    :param sampleSize: the sum of all row sums if known (see read_sample_size), computed from rowSums otherwise
+    :param words: optional targets, only their rows are computed and the rows of the other targets are empty
+    :param topN: optional number of contexts to keep per row, the rows are computed one at a time and only
+    their top N contexts are kept (see top_positions), enough for SLQS with the same or a smaller top N
+    :param chunkSize: number of cells computed at a time
+    :return: SparseDSM with the plmi values as data
+    """
+    if not isinstance(dsm, SparseDSM):
+        dsm = SparseDSM.from_dict(dsm)
+    if sampleSize is None:
+        sampleSize = sample_size(rowSums)
+    totals = row_sums_array(dsm, rowSums)
+
+    if words is None and topN is None:
+        # plmi is symmetric in target and context, the upper triangle of a symmetric DSM stays an upper triangle
+        indptr = np.asarray(dsm.indptr)
+        plmis = np.empty(len(dsm.data))
+        for start in tqdm(range(0, len(plmis), chunkSize)):
+            end = min(start + chunkSize, len(plmis))
+            rows = np.searchsorted(indptr, np.arange(start, end), side="right") - 1
+            plmis[start:end] = plmi_values(dsm.data[start:end], totals[rows], totals[dsm.indices[start:end]],
+                                           sampleSize)
+        kept = plmis > 0
+        keptBefore = np.concatenate(([0], np.cumsum(kept)))
+        return SparseDSM(dsm.vocab, keptBefore[indptr], dsm.indices[kept], plmis[kept], dsm.symmetric)
+
+    lengths = np.zeros(dsm.nRows, dtype=np.int64)
+    contextRows = []
+    plmiRows = []
+    rows = range(dsm.nRows) if words is None else sorted(dsm.index[word] for word in words if word in dsm)
+    for i in tqdm(rows):
+        contexts, counts = dsm.row_arrays(i)
+        plmis = plmi_values(counts, totals[i], totals[contexts], sampleSize)
+        kept = plmis > 0 if topN is None else top_positions(plmis, topN)
+        lengths[i] = len(plmis[kept])
+        contextRows.append(contexts[kept])
+        plmiRows.append(plmis[kept])
+    indptr = np.zeros(dsm.nRows + 1, dtype=np.int64)
+    np.cumsum(lengths, out=indptr[1:])
+    indices = np.concatenate(contextRows) if contextRows else np.zeros(0, dtype=np.int32)
+    data = np.concatenate(plmiRows) if plmiRows else np.zeros(0)
+
+    return SparseDSM(dsm.vocab, indptr, indices, data)
+
+
 def read_from_pickle(file: str):
     """
     this function reads an object from a pickle file and returns it
@@ -1,17 +1,25 @@
 import pickle
+import os
+import sys
 from tqdm import tqdm
 from docopt import docopt
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from sparse_dsm import SparseDSM, has_marginals, read_dsm, read_row_sums
+from artifacts import Stage
 
 
 def main():
     args = docopt("""Calculate row sum for each target of the DSM and save it in dict
     
     Usage:
-        rowSums.py <dsm_file> <output_file_rowSums>
+        rowSums.py <dsm_file> <output_file_rowSums> [--cached]
         
     Arguments:
-        <dsm_file> = file containing the pickled DSM
+        <dsm_file> = file containing the pickled DSM or directory containing the SparseDSM
         <output_file_rowSums> = file to save the pickled rowSums dict
+
+    Options:
+        --cached  skip if the outputs were saved by a run with the same arguments and inputs, see artifacts.py
     
     """)
 
@@ -19,22 +27,43 @@ def main():
     dsm = args['<dsm_file>']
     output_file_rowSums = args['<output_file_rowSums>']
 
+    stage = Stage("rowSums", args, ['<dsm_file>'], [output_file_rowSums])
+    if stage.up_to_date():
+        print("Outputs are up to date, skipped")
+        return
+
     rowSums = row_sum(dsm)
     save_to_pickle(rowSums, output_file_rowSums)
     print("Row sums saved")
+    stage.done()
 
 
 def row_sum(dsmFile: str):
     """
     Calculate row sums
-    :param dsmFile: pickle file cotaining the DSM
+    :param dsmFile: pickle file cotaining the DSM or directory containing the SparseDSM
     :return: row sums as dictionary
     """
+    if has_marginals(dsmFile):
+        # saved together with the DSM, no need to load it
+        print("Loading row sums...")
+        rowSums = read_row_sums(dsmFile)
+        print("Row sums loaded")
+        return rowSums
     print("Loading DSM...")
-    dsm = read_from_pickle(dsmFile)
+    dsm = read_dsm(dsmFile)
     print("DSM loaded")
-    rowSums = {}
     print("Calculating row sums")
+    if isinstance(dsm, SparseDSM):
+        if dsm.totals is not None:
+            # restricted DSM, the row sums of all words were counted before the rows were dropped
+            rowSums = dict(zip(dsm.vocab, dsm.totals.tolist()))
+        else:
+            # sum up the count arrays of all rows at once
+            rowSums = dict(zip(dsm, dsm.row_sums().tolist()))
+        print("Row sums calculated")
+        return rowSums
+    rowSums = {}
     for target, context in tqdm(dsm.items()):
         # sum up all co-occurrence counts
         rowSum = sum(dsm[target].values())
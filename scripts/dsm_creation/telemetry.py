@@ -0,0 +1,97 @@
+import json
+import os
+import resource
+import time
+
+
+class Telemetry:
+
+    def __init__(self, file: str, every: float = 60.0, shard: int = None):
+        """
+        Writes throughput and memory metrics of a pass through the corpus to a JSON-lines file, one record
+        every few seconds and a final one at the end
+        :param file: the JSON-lines file, records are appended (workers write to the same file)
+        :param every: number of seconds between two records
+        :param shard: optional index of the corpus shard, written with every record
+        """
+        self.file = file
+        self.every = every
+        self.shardIndex = shard
+        # totals since the start of the pass
+        self.sentences = 0
+        self.tokens = 0
+        # word lines of the corpus dropped by the pos-tag filter
+        self.filtered = 0
+        # time and totals of the last record, None until the pass starts
+        self.start = None
+        self.last = None
+
+    def shard(self, index: int):
+        """
+        Get the telemetry of a shard of the corpus
+        :param index: the index of the shard
+        :return: Telemetry
+        """
+        return Telemetry(self.file, self.every, index)
+
+    def add(self, tokens: int, sentences: int = 1):
+        """
+        Count sentences and their (kept) lemmas
+        :param tokens: number of lemmas
+        :param sentences: number of sentences
+        """
+        if self.start is None:
+            self.start = time.monotonic()
+            self.last = (self.start, 0, 0)
+        self.tokens += tokens
+        self.sentences += sentences
+
+    def due(self):
+        """
+        Check whether the next record should be written
+        :return: True if every seconds passed since the last record
+        """
+        return time.monotonic() - self.last[0] >= self.every
+
+    def emit(self, targets: int, cells: int, final: bool = False):
+        """
+        Append a record with the rates since the last record and the current totals
+        :param targets: number of distinct targets (rows) counted so far
+        :param cells: number of nonzero cells counted so far
+        :param final: True for the record at the end of the pass
+        """
+        if self.start is None:
+            self.add(0, 0)
+        now = time.monotonic()
+        lastTime, lastSentences, lastTokens = self.last
+        seconds = max(now - lastTime, 1e-9)
+        record = {"time": time.time(),
+                  "elapsed": now - self.start,
+                  "shard": self.shardIndex,
+                  "sentences": self.sentences,
+                  "tokens": self.tokens,
+                  "sentencesPerSecond": (self.sentences - lastSentences) / seconds,
+                  "tokensPerSecond": (self.tokens - lastTokens) / seconds,
+                  "lemmasKept": self.tokens,
+                  "lemmasFiltered": self.filtered,
+                  "targets": targets,
+                  "cells": cells,
+                  "rssMB": rss() / 1024 / 1024,
+                  "maxRssMB": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+                  "final": final}
+        # one write per record, so that the lines of several workers are not mixed
+        with open(self.file, "a") as metrics:
+            metrics.write(json.dumps(record) + "\n")
+        self.last = (now, self.sentences, self.tokens)
+
+
+def rss():
+    """
+    Get the current resident set size of the process (the peak size if /proc is not available)
+    :return: the size in bytes
+    """
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
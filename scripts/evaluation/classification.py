@@ -1,14 +1,12 @@
 import pickle
+import os
+import sys
 from tqdm import tqdm
 import random
 import numpy as np
-from sklearn.linear_model import LogisticRegression
-from sklearn.model_selection import train_test_split
-from sklearn.tree import DecisionTreeClassifier, plot_tree
-from sklearn.tree import export_graphviz
-from graphviz import Source
-from subprocess import call
 from docopt import docopt
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from artifacts import Stage
 
 def main():
     args = docopt("""Cunduct unsupervised classification on a data set with Logistic Regression and Decision Tree, with word frequency, word length and slqs as input features
@@ -16,10 +14,10 @@ def main():
     Optionally set maximum depth for decision tree creation
     
     Usage:
-        classification.py <dataset_file> <results_freq> <results_slqs> <output_file_logReg> <output_file_decTree>
-        classification.py <dataset_file> <results_freq> <results_slqs> <output_file_logReg> <output_file_decTree> -m <max_depth> 
-        classification.py <dataset_file> <results_freq> <results_slqs> <output_file_logReg> <output_file_decTree> -d [-l <depth>]
-        classification.py <dataset_file> <results_freq> <results_slqs> <output_file_logReg> <output_file_decTree> -m <max_depth> -d [-l <depth>]
+        classification.py <dataset_file> <results_freq> <results_slqs> <output_file_logReg> <output_file_decTree> [--cached]
+        classification.py <dataset_file> <results_freq> <results_slqs> <output_file_logReg> <output_file_decTree> -m <max_depth> [--cached]
+        classification.py <dataset_file> <results_freq> <results_slqs> <output_file_logReg> <output_file_decTree> -d [-l <depth>] [--cached]
+        classification.py <dataset_file> <results_freq> <results_slqs> <output_file_logReg> <output_file_decTree> -m <max_depth> -d [-l <depth>] [--cached]
         
     Arguments:
         <dataset_file> = pickled data set
@@ -34,6 +32,7 @@ def main():
         -d --draw  draw the decision tree
         -l --limit  draw only part of the tree
         -m --max  create tree with maximum depth
+        --cached  skip if the outputs were saved by a run with the same arguments and inputs, see artifacts.py
     
     """)
 
@@ -55,6 +54,12 @@ def main():
     else:
         max_depth = 0
 
+    stage = Stage("classification", args, ['<dataset_file>', '<results_freq>', '<results_slqs>'],
+                  [output_file_logReg, output_file_decTree])
+    if stage.up_to_date():
+        print("Outputs are up to date, skipped")
+        return
+
     print("Loading results and data set")
     dataset = list(read_from_pickle(dataset_file))
     wordFreq = read_from_pickle(results_freq)
@@ -65,6 +70,8 @@ def main():
     x, y = create_vectors_invert(dataset, wordFreq, slqs)
     print("Created vectors")
 
+    # sklearn is only imported when the classification runs, so that --help starts fast
+    from sklearn.model_selection import train_test_split
     xTrain, xTest, yTrain, yTest = train_test_split(x, y, test_size=0.2, random_state=0, stratify=y)
 
     print("Running Logistic Regression...")
@@ -82,6 +89,7 @@ def main():
         decTreeFile.write("Test accuracy:" + str(accuracyTest) + "\n")
         decTreeFile.write("Feature importances [word frequency, word length, slqs]: " + str(featureImportances))
     print("Decision Tree done")
+    stage.done()
 
 
 def create_vectors_invert(wordPairs:list, wordFrequency:dict, slqsResults:dict):
@@ -151,6 +159,7 @@ def logistic_regression(xTrain, yTrain, xTest, yTest):
     :param yTest: test data predictions
     :return: evaluation
     """
+    from sklearn.linear_model import LogisticRegression
     # initialize model
     model = LogisticRegression(solver="liblinear", random_state=0)
     # train model
@@ -177,6 +186,7 @@ def decision_tree(xTrain, yTrain, xTest, yTest, is_draw, is_limit, is_max, depth
     :param max_depth: the optional maximum depth
     :return: evaluation
     """
+    from sklearn.tree import DecisionTreeClassifier, export_graphviz
     # check if tree should be created with maximum depth
     # initialize model
     if is_max:
@@ -203,6 +213,7 @@ def decision_tree(xTrain, yTrain, xTest, yTest, is_draw, is_limit, is_max, depth
             export_graphviz(model, out_file='tree.dot', feature_names=["Freq", "Length", "SLQS"], filled=True, class_names=["0", "1"])
 
         # save tree as .png
+        from subprocess import call
         call(['dot', '-T', 'png', 'tree.dot', '-o', 'tree.png'])
         print("Tree drawn and saved")
 
@@ -1,13 +1,16 @@
 import pickle
-from tabulate import tabulate
+import os
+import sys
 from tqdm import tqdm
 from docopt import docopt
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from artifacts import Stage
 
 def main():
     args = docopt("""Evaluate measure(s) on data set(s) and save results in .txt file(s)
     
     Usage:
-        evaluation.py (-f <results_freq> | -l | -w <results_weedsPrec> | -i <results_invCL> | -r <results_slqsRow> | -s <results_slqs>)... (-a <output_file_accuracy> | -c <output_file_smc> | -p <output_file_proportions>)... (<dataset_file> <name>)...
+        evaluation.py (-f <results_freq> | -l | -w <results_weedsPrec> | -i <results_invCL> | -r <results_slqsRow> | -s <results_slqs>)... (-a <output_file_accuracy> | -c <output_file_smc> | -p <output_file_proportions>)... (<dataset_file> <name>)... [--cached]
         
     Arguments:
         <results_freq> = pickled word frequency results
@@ -31,6 +34,7 @@ def main():
         -a --accuracy  calculate accuracy
         -c --correlation  claculate smc correlations
         -p --proportions  calculate intersection proportions
+        --cached  skip if the outputs were saved by a run with the same arguments and inputs, see artifacts.py
     
     """)
 
@@ -59,6 +63,17 @@ def main():
     is_correlation = args['--correlation']
     is_proportions = args['--proportions']
 
+    stage = Stage("evaluation", args, ['<results_freq>', '<results_weedsPrec>', '<results_invCL>', '<results_slqsRow>',
+                                        '<results_slqs>', '<dataset_file>'],
+                  output_file_accuracy + output_file_smc + output_file_proportions,
+                  ignore=('<output_file_accuracy>', '<output_file_smc>', '<output_file_proportions>'))
+    if stage.up_to_date():
+        print("Outputs are up to date, skipped")
+        return
+
+    # imported when the evaluation runs, so that --help does not need it
+    from tabulate import tabulate
+
     print("Loading data sets...")
     datasets = []
     for data in dataset_file:
@@ -147,6 +162,7 @@ def main():
                 propFile.write(tabulate(table, headers=measures, tablefmt="plain"))
                 propFile.write("\n\n")
         print("Calculated intersection proportions")
+    stage.done()
 
 
 def accuracy(evaluation):
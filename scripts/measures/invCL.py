@@ -1,35 +1,55 @@
 import pickle
+import os
+import sys
 from tqdm import tqdm
 import math
+import numpy as np
 from docopt import docopt
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from sparse_dsm import SparseDSM, read_dsm, read_row_sums, shared_directory
+from artifacts import Stage
 
 
 def main():
     args = docopt("""Calculate InvCL and save as dict
 
     Usage:
-        invCL.py <dsm_file> <rowSums_file> <output_file_results> (<dataset_file>...)
+        invCL.py <dsm_file> <rowSums_file> <output_file_results> (<dataset_file>...) [--cached]
+        invCL.py --shared=<name> <output_file_results> (<dataset_file>...) [--cached]
 
     Arguments:
-        <dsm_file> = file containing the pickled DSM
-        <rowSums_file> = file containing the pickled row sums
+        <dsm_file> = file containing the pickled DSM or directory containing the SparseDSM
+        <rowSums_file> = file containing the pickled row sums, or the DSM file/directory if its marginals were saved with it
         <dataset_file> = file containing the pickled data set
         <output_file_results> = file to save the pickled results
 
+    Options:
+        --shared=<name>  attach to the DSM and row sums placed in shared memory with dsm_share.py instead of reading them
+        --cached  skip if the outputs were saved by a run with the same arguments and inputs, see artifacts.py
+
     """)
 
+    if args['--shared']:
+        # the shared DSM contains the row sums
+        args['<dsm_file>'] = args['<rowSums_file>'] = shared_directory(args['--shared'])
+
     # get arguments
     dsm_file = args['<dsm_file>']
     rowSums_file = args['<rowSums_file>']
     dataset_file = args['<dataset_file>']
     output_file_results = args['<output_file_results>']
 
+    stage = Stage("invCL", args, ['<dsm_file>', '<rowSums_file>', '<dataset_file>'], [output_file_results])
+    if stage.up_to_date():
+        print("Outputs are up to date, skipped")
+        return
+
     print("Loading DSM...")
-    dsm = read_from_pickle(dsm_file)
+    dsm = read_dsm(dsm_file)
     print("Loaded DSM")
 
     print("Loading row sums...")
-    rowSums = read_from_pickle(rowSums_file)
+    rowSums = read_row_sums(rowSums_file, dsm)
     print("Loaded row sums")
 
     print("Loading data set(s)...")
@@ -45,6 +65,7 @@ def main():
 
     save_to_pickle(results, output_file_results)
     print("Saved")
+    stage.done()
 
 
 def inv_CL(dsm, rowSums, wordPairs):
@@ -65,13 +86,18 @@ def inv_CL(dsm, rowSums, wordPairs):
 
         # clarkeDE
         # direction 1
-        numerator = 0
-        # get intersection of contexts of hyponym and hypernym
-        contextIntersection = dsm[hypo].keys() & dsm[hyper].keys()
-        # iterate over these common contexts
-        for context in contextIntersection:
-            # get the minimum and add it to the numerator
-            numerator = numerator + min(dsm[hypo][context], dsm[hyper][context])
+        if isinstance(dsm, SparseDSM):
+            # minimum of the co-occurrence counts for the common contexts on the count arrays
+            hypoCounts, hyperCounts = dsm.common_contexts(hypo, hyper)
+            numerator = int(np.minimum(hypoCounts, hyperCounts).sum())
+        else:
+            numerator = 0
+            # get intersection of contexts of hyponym and hypernym
+            contextIntersection = dsm[hypo].keys() & dsm[hyper].keys()
+            # iterate over these common contexts
+            for context in contextIntersection:
+                # get the minimum and add it to the numerator
+                numerator = numerator + min(dsm[hypo][context], dsm[hyper][context])
 
         # sum all frequencies of hyponym
         denominator = rowSums[hypo]
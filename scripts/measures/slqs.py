@@ -1,47 +1,87 @@
 import pickle
-import math
+import json
+import os
+import sys
 import statistics
+from multiprocessing import get_context
+import numpy as np
 from collections import OrderedDict
 from operator import itemgetter
 from tqdm import tqdm
 from docopt import docopt
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from sparse_dsm import read_dsm, read_entropies, read_row_sums, read_sample_size, shared_directory, word_entropies
+from artifacts import Stage, digest, quick_fingerprint
 
 def main():
     args = docopt("""Calculate SLQS and save results as dict
     
     Usage:
-        slqs.py <dsm_file> <plmi_file> <rowSums_file> <top_N> <output_file_results> (<dataset_file>...)
+        slqs.py <dsm_file> <plmi_file> <rowSums_file> <top_N> <output_file_results> (<dataset_file>...) [-c <dir>] [-w <n>] [--cached]
+        slqs.py --shared=<name> <plmi_file> <top_N> <output_file_results> (<dataset_file>...) [-c <dir>] [-w <n>] [--cached]
         
     Arguments:
-        <dsm_file> = file containing the pickled DSM
-        <plmi_file> = file containing the pickled plmi values
-        <top_N> = integer setting the top N contexts for second order word entropy
-        <rowSums_file> = file containing the pickled row sums
+        <dsm_file> = file containing the pickled DSM or directory containing the SparseDSM
+        <plmi_file> = file containing the pickled plmi values, or directory containing them as SparseDSM (plmi.py --sparse or --top-n)
+        <top_N> = integer setting the top N contexts for second order word entropy, or several comma-separated integers (e.g. 10,25,50) calculated from one ranking of the contexts
+        <rowSums_file> = file containing the pickled row sums, or the DSM file/directory if its marginals were saved with it
         <dataset_file> = file containing the pickled data set
-        <output_file_results> = file to save the pickled results
+        <output_file_results> = file to save the pickled results, with several top N "{}" is replaced by N (or it is appended)
+
+    Options:
+        -c --cache=<dir>  directory to keep the second order entropies between runs, one file per DSM, row sums, kind of plmi values and top_N, only the words that are not in it are calculated
+        -w --workers=<n>  number of processes calculating the second order entropies of chunks of the words in parallel [default: 1]
+        --shared=<name>  attach to the DSM and row sums placed in shared memory with dsm_share.py instead of reading them
+        --cached  skip if the outputs were saved by a run with the same arguments and inputs, see artifacts.py
     
     """)
 
+    if args['--shared']:
+        # the shared DSM contains the row sums
+        args['<dsm_file>'] = args['<rowSums_file>'] = shared_directory(args['--shared'])
+
     #get arguments
     dsm_file = args['<dsm_file>']
     plmi_file = args['<plmi_file>']
     rowSums_file = args['<rowSums_file>']
-    topN = int(args['<top_N>'])
+    topNs = sorted(set(int(n) for n in args['<top_N>'].split(",")))
+    topN = topNs if len(topNs) > 1 else topNs[0]
     dataset_file = args['<dataset_file>']
     output_file_results = args['<output_file_results>']
+    cache_dir = args['--cache']
+    workers = int(args['--workers'])
+
+    # one results dict per top N
+    output_files = [topn_file(output_file_results, n, topNs) for n in topNs]
+    stage = Stage("slqs", args, ['<dsm_file>', '<plmi_file>', '<rowSums_file>', '<dataset_file>'],
+                  output_files, ignore=('--cache', '--workers'))
+    if stage.up_to_date():
+        print("Outputs are up to date, skipped")
+        return
 
     print("Loading DSM...")
-    dsm = read_from_pickle(dsm_file)
+    dsm = read_dsm(dsm_file)
     print("Loaded DSM")
 
     print("Loading plmi...")
-    plmi = read_from_pickle(plmi_file)
+    plmi = read_dsm(plmi_file)
+    # plmi.py --top-n only keeps the top N contexts of each row
+    if os.path.isdir(plmi_file) and os.path.exists(os.path.join(plmi_file, "topn.npy")):
+        plmiTopN = int(np.load(os.path.join(plmi_file, "topn.npy")))
+        if plmiTopN < topNs[-1]:
+            raise ValueError("the plmi values only contain the top " + str(plmiTopN) + " contexts, top_N is "
+                             + str(topNs[-1]))
     print("Loaded plmi")
 
     print("Loading row sums...")
-    rowSums = read_from_pickle(rowSums_file)
+    rowSums = read_row_sums(rowSums_file, dsm)
+    sampleSize = read_sample_size(rowSums_file)
     print("Loaded row sums")
 
+    print("Loading entropies...")
+    entropies = read_entropies(dsm_file, dsm)
+    print("Loaded entropies")
+
     print("Loading data set(s)...")
     pairs = set()
     for data in dataset_file:
@@ -49,13 +89,32 @@ def main():
         pairs = pairs | dataset
     print("Loaded data sets")
 
+    # second order entropies per top N
+    medianEntropy = {n: {} for n in topNs}
+    if cache_dir:
+        cacheFiles = cache_files(cache_dir, dsm_file, plmi_file, rowSums_file, topNs)
+        for n, cacheFile in cacheFiles.items():
+            if os.path.exists(cacheFile):
+                medianEntropy[n] = read_from_pickle(cacheFile)
+            print("Loaded " + str(len(medianEntropy[n])) + " second order entropies (top " + str(n) + ") from the cache")
+
     print("Calculating SLQS...")
-    slqs = SLQS(dsm, plmi, rowSums, topN)
+    slqs = SLQS(dsm, plmi, rowSums, topN, sampleSize, entropies,
+                medianEntropy if len(topNs) > 1 else medianEntropy[topN], workers)
     results = slqs.calculate_slqs(pairs)
-    print("Calculated SLQS")
+    print("Calculated SLQS (" + str(slqs.calculated) + " second order entropies)")
+
+    if cache_dir and slqs.calculated > 0:
+        for n, cacheFile in cacheFiles.items():
+            save_cache(slqs.medianEntropies[n], cacheFile)
 
-    save_to_pickle(results, output_file_results)
+    # one results dict per top N
+    if len(topNs) == 1:
+        results = {topN: results}
+    for n in topNs:
+        save_to_pickle(results[n], topn_file(output_file_results, n, topNs))
     print("Saved")
+    stage.done()
 
 
 def sample_size(rowSums:dict):
@@ -70,41 +129,132 @@ def sample_size(rowSums:dict):
 
     return sampleSize
 
-class SLQS:
+def topn_file(file: str, topN: int, topNs: list):
+    """
+    Get the output file for the results of one of several top N
+    :param file: the output file, "{}" is replaced by N
+    :param topN: the top N of the results
+    :param topNs: all top N
+    :return: the output file for the top N
+    """
+    if len(topNs) == 1:
+        return file
+    if "{}" in file:
+        return file.replace("{}", str(topN))
+    root, extension = os.path.splitext(file)
+    return root + "_" + str(topN) + extension
+
+
+def cache_files(directory: str, dsmFile: str, plmiFile: str, rowSumsFile: str, topNs: list):
+    """
+    Get the files of the cached second order entropies, named by the fingerprints of the DSM and the row sums
+    (see quick_fingerprint in artifacts.py), the kind of plmi values (see plmi_kind) and top N
+    The plmi values themselves are not part of the name, plmi values of other data sets share the cache
+    :param directory: the cache directory
+    :param dsmFile: the DSM file
+    :param plmiFile: the plmi file
+    :param rowSumsFile: the row sums file
+    :param topNs: numbers of top contexts
+    :return: dict[top N:cache file]
+    """
+    fingerprints = {}
+    for file in (dsmFile, rowSumsFile):
+        path = os.path.realpath(file)
+        # e.g. the DSM directory as row sums is fingerprinted once
+        if path not in fingerprints:
+            fingerprints[path] = quick_fingerprint(file)
+    kind = plmi_kind(dsmFile, plmiFile)
+    files = {}
+    for n in topNs:
+        key = json.dumps([list(fingerprints.values()), kind, n])
+        files[n] = os.path.join(directory, "slqs_" + digest(key.encode("utf-8"))[:32] + ".p")
+
+    return files
+
+
+def plmi_kind(dsmFile: str, plmiFile: str):
+    """
+    Get the order in which the contexts of a row of the plmi values are ranked when their values tie, it decides which
+    contexts are the top N: pickled plmi values of a pickled DSM keep the order of the DSM rows (first co-occurrence
+    with the target), all other plmi values are ordered by context ID. plmi.py --sparse, --all and -n (for a top_N up
+    to N, see top_positions in plmi.py) therefore give the same second order entropies
+    :param dsmFile: the DSM file
+    :param plmiFile: the plmi file
+    :return: "rows" or "ids"
+    """
+    if not os.path.isdir(dsmFile) and not os.path.isdir(plmiFile):
+        return "rows"
+    return "ids"
+
+
+def save_cache(medianEntropy: dict, file: str):
+    """
+    Save the second order entropies to the cache, merged with entropies saved by other runs in the meantime
+    :param medianEntropy: dict[word:second order entropy]
+    :param file: the cache file
+    """
+    os.makedirs(os.path.dirname(file) or ".", exist_ok=True)
+    if os.path.exists(file):
+        medianEntropy = dict(read_from_pickle(file), **medianEntropy)
+    # replaced at once, other runs may read the cache at the same time
+    temporary = file + "." + str(os.getpid())
+    save_to_pickle(medianEntropy, temporary)
+    os.replace(temporary, file)
+
+
+# the SLQS of the parent process, inherited by the forked workers instead of pickling the DSM
+_forkedSLQS = None
 
-    entropyDict = {}
-    medianEntropy = {}
 
-    def __init__(self, dsm, dsmPLMI, rowSums, topN):
+def second_order_entropy_chunk(words: list):
+    """
+    Calculate the second order entropies of a chunk of words in a worker of SLQS.second_order_entropies()
+    :param words: the words
+    :return: dict[word:dict[top N:second order entropy]]
+    """
+    return {word: _forkedSLQS.median_entropy_top_contexts(_forkedSLQS.top_N_contexts(word)) for word in words}
+
+
+class SLQS:
+
+    def __init__(self, dsm, dsmPLMI, rowSums, topN, sampleSize=None, entropies=None, medianEntropy=None, workers=1):
         """
         
         :param dsm: the DSM
         :param dsmPLMI: the Positive Local Mutual Information values
         :param rowSums: the row sums
-        :param topN: number of top contexts for second order word entropy
+        :param topN: number of top contexts for second order word entropy, or a list of numbers, which are all calculated
+        from one ranking of the contexts
+        :param sampleSize: the sum of all row sums if known (see read_sample_size), computed from rowSums otherwise
+        :param entropies: the entropies of the words if saved with the DSM (see read_entropies), calculated otherwise
+        :param medianEntropy: optional second order entropies of earlier runs with the same DSM and top N (see cache_files),
+        a dict[top N:dict] with a list of top N
+        :param workers: number of processes calculating the second order entropies in parallel
         """
         self.dsm = dsm
         self.dsmPLMI = dsmPLMI
         self.rowSums = rowSums
-        self.sampleSize = sample_size(self.rowSums)
+        self.sampleSize = sampleSize if sampleSize is not None else sample_size(self.rowSums)
         self.topN = topN
+        self.topNs = sorted(topN) if isinstance(topN, list) else [topN]
+        self.entropies = entropies if entropies is not None else word_entropies(dsm)
+        # second order entropy of every word loaded or calculated so far, per top N, one float per word,
+        # all of them are kept, so that none is calculated twice and the cache file (see save_cache) gets all of them
+        if medianEntropy is None:
+            medianEntropy = {n: {} for n in self.topNs} if isinstance(topN, list) else {}
+        self.medianEntropy = medianEntropy
+        self.medianEntropies = medianEntropy if isinstance(topN, list) else {topN: medianEntropy}
+        self.workers = workers
+        # number of second order entropies calculated, not taken from the cache
+        self.calculated = 0
 
     def entropy(self, word: str):
         """
-        Calculate word entropy
+        Get the word entropy, calculated for all words at once (see read_entropies)
         :param word: the word
         :return: entropy of the word
         """
-        entropy = 0
-        wordCoocFreq = self.rowSums[word]
-
-        # iterate over all contexts of the word
-        for context, freq in self.dsm[word].items():
-            probWordContext = freq / wordCoocFreq
-            entropy += probWordContext * math.log2(probWordContext)
-
-        entropy = -entropy
-        return entropy
+        return self.entropies[word]
 
     def top_N_contexts(self, word: str):
         """
@@ -119,31 +269,30 @@ class SLQS:
             if plmi > 0:
                 plmis[context] = plmi
 
-        # sort plmi values and get top N
-        topN = dict(list(OrderedDict(sorted(plmis.items(), key=itemgetter(1), reverse=True)).items())[:self.topN])
+        # sort plmi values and get top N (the largest N), the first n of them are the top n
+        topN = dict(list(OrderedDict(sorted(plmis.items(), key=itemgetter(1), reverse=True)).items())[:self.topNs[-1]])
 
         return topN
 
     def median_entropy_top_contexts(self, topContexts: dict):
         """
-        Calculate median entropy of the top N contexts
-        :param topContexts: top N contexts
-        :return: median entropy
+        Calculate median entropy of the top N contexts for every top N
+        :param topContexts: top N contexts, sorted by plmi
+        :return: dict[top N:median entropy]
         """
         entropies = {}
         # iterate over top contexts
         for context, plmi in topContexts.items():
-            # check if entropy already calculated
-            # if not, calculate and store in dictionary
-            if context not in self.entropyDict:
-                self.entropyDict[context] = self.entropy(context)
             # get entropy of context
-            entropies[context] = self.entropyDict[context]
-        # claculate median entropy
-        if len(entropies) != 0:
-            medianEntropy = statistics.median(entropies.values())
-        else:
-            medianEntropy = 0
+            entropies[context] = self.entropy(context)
+        entropies = list(entropies.values())
+        # claculate median entropy of the first n contexts
+        medianEntropy = {}
+        for n in self.topNs:
+            if len(entropies) != 0:
+                medianEntropy[n] = statistics.median(entropies[:n])
+            else:
+                medianEntropy[n] = 0
 
         return medianEntropy
 
@@ -151,14 +300,14 @@ class SLQS:
         """
         Calculate second order word entropy
         :param word: the word
-        :return: second order word entropy
+        :return: second order word entropy, a dict[top N:second order word entropy] with a list of top N
         """
         # get top N contexts for word
         topContexts = self.top_N_contexts(word)
         # claculate median entropy for top N contexts of word
         medianEntropyWord = self.median_entropy_top_contexts(topContexts)
 
-        return medianEntropyWord
+        return medianEntropyWord if isinstance(self.topN, list) else medianEntropyWord[self.topN]
 
     def calculate_slqs(self, wordPairs:set):
         """
@@ -168,36 +317,71 @@ class SLQS:
         In Proceedings of the 14th Conference of the European Chapter of the Association for Computational Linguistics,
         volume 2: Short Papers, pages 38–42, 2014.
         :param wordPairs: the word pairs
+        :return: SLQS results as dictionary, a dict[top N:results] with a list of top N
+        """
+        # check if second order wntropy already calculated for every top N, if not calculate it, each word once
+        words = [word for word in dict.fromkeys(word for wordPair in wordPairs for word in wordPair)
+                 if any(word not in self.medianEntropies[n] for n in self.topNs)]
+        for word, medianEntropyWord in self.second_order_entropies(words).items():
+            for n in self.topNs:
+                self.medianEntropies[n][word] = medianEntropyWord[n]
+        self.calculated += len(words)
+
+        # the pairs of every top N
+        results = {n: self.slqs_results(wordPairs, self.medianEntropies[n]) for n in self.topNs}
+
+        return results if isinstance(self.topN, list) else results[self.topN]
+
+    def second_order_entropies(self, words: list):
+        """
+        Calculate the second order entropies of the words, with self.workers processes over chunks of the words
+        :param words: the words, each is calculated once
+        :return: dict[word:dict[top N:second order entropy]]
+        """
+        if self.workers <= 1 or len(words) <= 1:
+            return {word: self.median_entropy_top_contexts(self.top_N_contexts(word)) for word in tqdm(words)}
+
+        global _forkedSLQS
+        # a few chunks per worker, so that the workers finish at about the same time
+        chunkSize = max(1, len(words) // (self.workers * 4))
+        chunks = [words[i:i + chunkSize] for i in range(0, len(words), chunkSize)]
+        medianEntropy = {}
+        _forkedSLQS = self
+        try:
+            # forked, the workers share the (memory-mapped) DSM and plmi values of this process
+            with get_context("fork").Pool(self.workers) as pool:
+                for chunk in tqdm(pool.imap_unordered(second_order_entropy_chunk, chunks), total=len(chunks)):
+                    medianEntropy.update(chunk)
+        finally:
+            _forkedSLQS = None
+
+        return medianEntropy
+
+    def slqs_results(self, wordPairs: set, medianEntropy: dict):
+        """
+        Calculate SLQS from the second order entropies of the words of one top N
+        :param wordPairs: the word pairs
+        :param medianEntropy: dict[word:second order entropy] of all words of the pairs
         :return: SLQS results as dictionary
         """
-        # sort word pairs for faster processing
-        wordPairs = list(wordPairs)
-        wordPairs = sorted(wordPairs)
-        wordPairs = set(wordPairs)
         results = {}
 
-        # iterate over word pairs
-        for wordPair in tqdm(wordPairs):
+        for wordPair in wordPairs:
             hypo = wordPair[0]
             hyper = wordPair[1]
-            # check if second order wntropy already calculated, if not calculate it
-            if hypo not in self.medianEntropy:
-                self.medianEntropy[hypo] = self.second_order_entropy(hypo)
-            if hyper not in self.medianEntropy:
-                self.medianEntropy[hyper] = self.second_order_entropy(hyper)
 
             # calculate SLQS for both directions
-            if self.medianEntropy[hypo] != 0 and self.medianEntropy[hyper] != 0:
-                slqs1 = 1 - (self.medianEntropy[hypo] / self.medianEntropy[hyper])
-                slqs2 = 1 - (self.medianEntropy[hyper] / self.medianEntropy[hypo])
+            if medianEntropy[hypo] != 0 and medianEntropy[hyper] != 0:
+                slqs1 = 1 - (medianEntropy[hypo] / medianEntropy[hyper])
+                slqs2 = 1 - (medianEntropy[hyper] / medianEntropy[hypo])
                 results[(hypo, hyper)] = slqs1
                 results[(hyper, hypo)] = slqs2
             # handle cases, where second order entropy = 0
             else:
-                if self.medianEntropy[hypo] == 0:
+                if medianEntropy[hypo] == 0:
                     results[wordPair] = 1
                     results[(hyper, hypo)] = -1
-                if self.medianEntropy[hyper] == 0:
+                if medianEntropy[hyper] == 0:
                     results[wordPair] = -1
                     results[(hyper, hypo)] = 1
 
@@ -1,37 +1,59 @@
 import pickle
-import math
+import os
+import sys
 from tqdm import tqdm
 from docopt import docopt
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from sparse_dsm import read_dsm, read_entropies, read_row_sums, shared_directory, word_entropies
+from artifacts import Stage
 
 
 def main():
     args = docopt("""Calculate SLQS Row and save results as dict
 
     Usage:
-        slqsRow.py <dsm_file> <rowSums_file> <output_file_results> (<dataset_file>...)
+        slqsRow.py <dsm_file> <rowSums_file> <output_file_results> (<dataset_file>...) [--cached]
+        slqsRow.py --shared=<name> <output_file_results> (<dataset_file>...) [--cached]
 
     Arguments:
-        <dsm_file> = file containing the pickled DSM
-        <rowSums_file> = file containing the pickled row sums
+        <dsm_file> = file containing the pickled DSM or directory containing the SparseDSM
+        <rowSums_file> = file containing the pickled row sums, or the DSM file/directory if its marginals were saved with it
         <dataset_file> = file containing the pickled data set
         <output_file_results> = file to save the pickled results
 
+    Options:
+        --shared=<name>  attach to the DSM and row sums placed in shared memory with dsm_share.py instead of reading them
+        --cached  skip if the outputs were saved by a run with the same arguments and inputs, see artifacts.py
+
     """)
 
+    if args['--shared']:
+        # the shared DSM contains the row sums
+        args['<dsm_file>'] = args['<rowSums_file>'] = shared_directory(args['--shared'])
+
     # get arguments
     dsm_file = args['<dsm_file>']
     rowSums_file = args['<rowSums_file>']
     dataset_file = args['<dataset_file>']
     output_file_results = args['<output_file_results>']
 
+    stage = Stage("slqsRow", args, ['<dsm_file>', '<rowSums_file>', '<dataset_file>'], [output_file_results])
+    if stage.up_to_date():
+        print("Outputs are up to date, skipped")
+        return
+
     print("Loading DSM...")
-    dsm = read_from_pickle(dsm_file)
+    dsm = read_dsm(dsm_file)
     print("Loaded DSM")
 
     print("Loading row sums...")
-    rowSums = read_from_pickle(rowSums_file)
+    rowSums = read_row_sums(rowSums_file, dsm)
     print("Loaded row sums")
 
+    print("Loading entropies...")
+    entropies = read_entropies(dsm_file, dsm)
+    print("Loaded entropies")
+
     print("Loading data set(s)...")
     pairs = set()
     for data in dataset_file:
@@ -40,42 +62,36 @@ def main():
     print("Loaded data sets")
 
     print("Calculating SLQS...")
-    slqs = SLQS(dsm, rowSums)
+    slqs = SLQS(dsm, rowSums, entropies)
     results = slqs.calculate_slqsRow(pairs)
     print("Calculated SLQS")
 
     save_to_pickle(results, output_file_results)
     print("Saved")
+    stage.done()
 
 
 
 class SLQS:
 
-    def __init__(self, dsm, rowSums):
+    def __init__(self, dsm, rowSums, entropies=None):
         """
         
         :param dsm: 
         :param rowSums: 
+        :param entropies: the entropies of the words if saved with the DSM (see read_entropies), calculated otherwise
         """
         self.dsm = dsm
         self.rowSums = rowSums
+        self.entropies = entropies if entropies is not None else word_entropies(dsm)
 
     def entropy(self, word: str):
         """
-        Calculate word entropy
+        Get the word entropy, calculated for all words at once (see read_entropies)
         :param word: the word
         :return: entropy of the word
         """
-        entropy = 0
-        wordCoocFreq = self.rowSums[word]
-
-        # iterate over all contexts of the word
-        for context, freq in self.dsm[word].items():
-            probWordContext = freq / wordCoocFreq
-            entropy += probWordContext * math.log2(probWordContext)
-
-        entropy = -entropy
-        return entropy
+        return self.entropies[word]
 
     def calculate_slqsRow(self, wordPairs: set):
         """
@@ -1,35 +1,54 @@
 import pickle
+import os
+import sys
 from tqdm import tqdm
 import math
 from docopt import docopt
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from sparse_dsm import SparseDSM, read_dsm, read_row_sums, shared_directory
+from artifacts import Stage
 
 
 def main():
     args = docopt("""Calculate WeedsPrec and save as dict
     
     Usage:
-        weedsPrec.py <dsm_file> <rowSums_file> <output_file_results> (<dataset_file>...)
+        weedsPrec.py <dsm_file> <rowSums_file> <output_file_results> (<dataset_file>...) [--cached]
+        weedsPrec.py --shared=<name> <output_file_results> (<dataset_file>...) [--cached]
         
     Arguments:
-        <dsm_file> = file containing the pickled DSM
-        <rowSums_file> = file containing the pickled row sums
+        <dsm_file> = file containing the pickled DSM or directory containing the SparseDSM
+        <rowSums_file> = file containing the pickled row sums, or the DSM file/directory if its marginals were saved with it
         <dataset_file> = file containing the pickled data set
         <output_file_results> = file to save the pickled results
+
+    Options:
+        --shared=<name>  attach to the DSM and row sums placed in shared memory with dsm_share.py instead of reading them
+        --cached  skip if the outputs were saved by a run with the same arguments and inputs, see artifacts.py
     
     """)
 
+    if args['--shared']:
+        # the shared DSM contains the row sums
+        args['<dsm_file>'] = args['<rowSums_file>'] = shared_directory(args['--shared'])
+
     # get arguments
     dsm_file = args['<dsm_file>']
     rowSums_file = args['<rowSums_file>']
     dataset_file = args['<dataset_file>']
     output_file_results = args['<output_file_results>']
 
+    stage = Stage("weedsPrec", args, ['<dsm_file>', '<rowSums_file>', '<dataset_file>'], [output_file_results])
+    if stage.up_to_date():
+        print("Outputs are up to date, skipped")
+        return
+
     print("Loading DSM...")
-    dsm = read_from_pickle(dsm_file)
+    dsm = read_dsm(dsm_file)
     print("Loaded DSM")
 
     print("Loading row sums...")
-    rowSums = read_from_pickle(rowSums_file)
+    rowSums = read_row_sums(rowSums_file, dsm)
     print("Loaded row sums")
 
     print("Loading data set(s)...")
@@ -45,6 +64,7 @@ def main():
 
     save_to_pickle(results, output_file_results)
     print("Saved")
+    stage.done()
 
 
 def weeds_prec(dsm, rowSums, wordPairs):
@@ -64,6 +84,13 @@ def weeds_prec(dsm, rowSums, wordPairs):
         hypo = wordPair[0]
         hyper = wordPair[1]
 
+        if isinstance(dsm, SparseDSM):
+            # sum the co-occurrence frequencies of both words for their common contexts on the count arrays
+            hypoCounts, hyperCounts = dsm.common_contexts(hypo, hyper)
+            results[(hypo, hyper)] = int(hypoCounts.sum()) / rowSums[hypo]
+            results[(hyper, hypo)] = int(hyperCounts.sum()) / rowSums[hyper]
+            continue
+
         # direction 1
         numerator = 0
         # get intersection of contexts of hyponym and hypernym
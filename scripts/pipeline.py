@@ -0,0 +1,220 @@
+import pickle
+import os
+import sys
+from multiprocessing import get_context
+from multiprocessing.connection import wait
+from docopt import docopt
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "dsm_creation"))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "measures"))
+from sparse_dsm import SparseDSM, read_dsm, read_entropies, read_row_sums, read_sample_size, shared_directory
+from artifacts import Stage
+from plmi import dsm_plmi, sparse_plmi
+from weedsPrec import weeds_prec
+from invCL import inv_CL
+import slqs
+import slqsRow
+
+
+def main():
+    args = docopt("""Calculate PLMI and the unsupervised hypernymy measures in one process, the DSM and the row sums are loaded once
+    and the measures are run as a dependency graph, PLMI is passed to SLQS in memory
+
+    Usage:
+        pipeline.py <dsm_file> <rowSums_file> <top_N> <output_prefix> (<dataset_file>...) [-m <measures>] [-p <output_file_plmi>] [-w <n>] [--cached]
+        pipeline.py --shared=<name> <top_N> <output_prefix> (<dataset_file>...) [-m <measures>] [-p <output_file_plmi>] [-w <n>] [--cached]
+
+    Arguments:
+        <dsm_file> = file containing the pickled DSM or directory containing the SparseDSM
+        <rowSums_file> = file containing the pickled row sums, or the DSM file/directory if its marginals were saved with it
+        <top_N> = number of top contexts for slqs
+        <output_prefix> = prefix of the files to save the pickled results, <output_prefix>_<measure>.p
+        <dataset_file> = file containing the pickled data set
+
+    Options:
+        -m --measures=<measures>  comma-separated measures to calculate [default: weedsPrec,invCL,slqsRow,slqs]
+        -p --plmi=<output_file_plmi>  also save the PLMI values as dict[target:dict[context:plmi]]
+        -w --workers=<n>  number of forked processes running independent measures at the same time, they share the DSM copy-on-write [default: 1]
+        --shared=<name>  attach to the DSM and row sums placed in shared memory with dsm_share.py instead of reading them
+        --cached  skip if the outputs were saved by a run with the same arguments and inputs, see artifacts.py
+
+    """)
+
+    if args['--shared']:
+        # the shared DSM contains the row sums
+        args['<dsm_file>'] = args['<rowSums_file>'] = shared_directory(args['--shared'])
+
+    # get arguments and options
+    dsm_file = args['<dsm_file>']
+    rowSums_file = args['<rowSums_file>']
+    topN = int(args['<top_N>'])
+    output_prefix = args['<output_prefix>']
+    dataset_file = args['<dataset_file>']
+    measures = args['--measures'].split(",")
+    output_file_plmi = args['--plmi']
+    workers = int(args['--workers'])
+
+    for measure in measures:
+        if measure not in STAGES or measure == "plmi":
+            raise ValueError("unknown measure " + measure + ", expected one of weedsPrec, invCL, slqsRow, slqs")
+    output_files = {measure: output_prefix + "_" + measure + ".p" for measure in measures}
+    if output_file_plmi:
+        output_files["plmi"] = output_file_plmi
+
+    stage = Stage("pipeline", args, ['<dsm_file>', '<rowSums_file>', '<dataset_file>'], list(output_files.values()),
+                  ignore=('<output_prefix>', '--workers'))
+    if stage.up_to_date():
+        print("Outputs are up to date, skipped")
+        return
+
+    print("Loading DSM...")
+    dsm = read_dsm(dsm_file)
+    print("Loaded DSM")
+
+    print("Loading row sums...")
+    rowSums = read_row_sums(rowSums_file, dsm)
+    sampleSize = read_sample_size(rowSums_file)
+    print("Loaded row sums")
+
+    print("Loading entropies...")
+    entropies = read_entropies(dsm_file, dsm)
+    print("Loaded entropies")
+
+    print("Loading data set(s)...")
+    pairs = set()
+    for data in dataset_file:
+        dataset = read_from_pickle(data)
+        pairs = pairs | dataset
+    print("Loaded data sets")
+
+    data = {"dsm": dsm, "rowSums": rowSums, "sampleSize": sampleSize, "entropies": entropies, "pairs": pairs,
+            "topN": topN, "savePLMI": output_file_plmi is not None}
+    results = run_stages(list(output_files), data, workers)
+
+    for name, output_file in output_files.items():
+        save_to_pickle(results[name], output_file)
+    print("Saved")
+    stage.done()
+
+
+def plmi_stage(data: dict):
+    # a dict DSM keeps the dict PLMI values of plmi.py, with the same order of tied contexts in slqs (see top_positions)
+    if data["savePLMI"] or not isinstance(data["dsm"], SparseDSM):
+        return dsm_plmi(data["pairs"], data["dsm"], data["rowSums"], data["sampleSize"])
+    # slqs only needs the top N contexts of each row
+    words = {word for pair in data["pairs"] for word in pair}
+    return sparse_plmi(data["dsm"], data["rowSums"], data["sampleSize"], words, data["topN"])
+
+
+def weedsPrec_stage(data: dict):
+    return weeds_prec(data["dsm"], data["rowSums"], data["pairs"])
+
+
+def invCL_stage(data: dict):
+    return inv_CL(data["dsm"], data["rowSums"], data["pairs"])
+
+
+def slqsRow_stage(data: dict):
+    return slqsRow.SLQS(data["dsm"], data["rowSums"], data["entropies"]).calculate_slqsRow(data["pairs"])
+
+
+def slqs_stage(data: dict):
+    return slqs.SLQS(data["dsm"], data["plmi"], data["rowSums"], data["topN"],
+                     data["sampleSize"], data["entropies"]).calculate_slqs(data["pairs"])
+
+
+# stage name: (names of the stages whose results are needed, function calculating the result)
+STAGES = {"plmi": ([], plmi_stage),
+          "weedsPrec": ([], weedsPrec_stage),
+          "invCL": ([], invCL_stage),
+          "slqsRow": ([], slqsRow_stage),
+          "slqs": (["plmi"], slqs_stage)}
+
+
+def run_stages(names: list, data: dict, workers: int = 1):
+    """
+    Run stages and the stages they depend on in the order of the dependency graph
+    With workers > 1, every stage whose dependencies are done is run in a forked process, so the loaded data
+    (e.g. the DSM) is shared copy-on-write and the results of the dependencies are passed in memory
+    :param names: names of the stages (see STAGES)
+    :param data: the loaded inputs, passed to every stage together with the results of its dependencies
+    :param workers: maximum number of processes running at the same time
+    :return: dict[stage name:result], including the dependencies
+    """
+    # the dependencies are started first, they are on the longest path through the graph
+    needed = []
+    for name in [dependency for name in names for dependency in STAGES[name][0]] + names:
+        if name not in needed:
+            needed.append(name)
+    results = {}
+    # connection to the process: (stage name, process)
+    running = {}
+    while len(results) < len(needed):
+        for name in needed:
+            if name in results or name in [job[0] for job in running.values()] or any(dep not in results for dep in STAGES[name][0]):
+                continue
+            if workers <= 1:
+                print("Calculating " + name + "...")
+                results[name] = STAGES[name][1](dict(data, **results))
+            elif len(running) < workers:
+                print("Calculating " + name + "...")
+                receiver, sender = get_context("fork").Pipe(duplex=False)
+                process = get_context("fork").Process(target=run_forked, args=(name, dict(data, **results), sender))
+                process.start()
+                sender.close()
+                running[receiver] = (name, process)
+        if not running:
+            continue
+        for receiver in wait(list(running)):
+            name, process = running.pop(receiver)
+            try:
+                result = receiver.recv()
+            except EOFError:
+                # the process died before it sent a result (e.g. killed for lack of memory)
+                process.join()
+                raise RuntimeError("the process calculating " + name + " died with exit code "
+                                   + str(process.exitcode))
+            process.join()
+            if isinstance(result, Exception):
+                raise result
+            results[name] = result
+            print("Calculated " + name)
+
+    return results
+
+
+def run_forked(name: str, data: dict, sender):
+    """
+    Run a stage in a forked process and send the result (or the exception) to the parent
+    :param name: the name of the stage
+    :param data: the inputs of the stage
+    :param sender: the connection to the parent
+    """
+    try:
+        result = STAGES[name][1](data)
+    except Exception as error:
+        result = error
+    sender.send(result)
+    sender.close()
+
+
+def read_from_pickle(file: str):
+    """
+    this function reads an object from a pickle file and returns it
+    :param file: the file containing the object
+    :return obj: the object
+    """
+    obj = pickle.load(open(file, "rb"))
+    return obj
+
+
+def save_to_pickle(obj, file: str):
+    """
+    this function saves an object to a pickle file
+    :param obj: the object
+    :param file: the file to save the object
+    """
+    pickle.dump(obj, open(file, "wb"), protocol=4)
+
+
+if __name__ == '__main__':
+    main()
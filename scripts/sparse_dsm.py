@@ -0,0 +1,1062 @@
+import os
+import pickle
+import shutil
+import tempfile
+from collections.abc import Mapping
+import numpy as np
+
+
+class SparseDSM(Mapping):
+    """
+    DSM that maps every lemma to an integer ID through a vocabulary and stores the co-occurrence counts in CSR arrays:
+    the contexts of target i are indices[indptr[i]:indptr[i + 1]] (sorted IDs) with counts data[indptr[i]:indptr[i + 1]]
+    The first nRows words of the vocabulary are targets, the remaining words only occur as contexts
+    A symmetric DSM only stores the upper triangle (context ID >= target ID), the lower triangle is mirrored from it
+    It can be used like the DSM as dict[target:dict[context:co-occurrence count]], rows are read-only mappings
+    """
+
+    def __init__(self, vocab: list, indptr, indices, data, symmetric: bool = False):
+        """
+
+        :param vocab: list of lemmas, the position of a lemma is its ID
+        :param indptr: row pointers, length number of targets + 1
+        :param indices: context IDs of all rows
+        :param data: co-occurrence counts of all rows
+        :param symmetric: if True, the arrays only contain the upper triangle, all words are targets
+        """
+        self.vocab = vocab
+        self.index = {word: i for i, word in enumerate(vocab)}
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int32)
+        # co-occurrence counts, or weights as floats (see sparse_plmi() in plmi.py)
+        data = np.asarray(data)
+        self.data = data if data.dtype.kind == "f" else data.astype(np.int64, copy=False)
+        self.nRows = len(self.indptr) - 1
+        # directory the arrays are memory-mapped from
+        self.directory = None
+        # row sums of all words of the vocabulary, only set if rows were restricted to some targets
+        self.totals = None
+        self.symmetric = symmetric
+        # lower triangle as CSR arrays (indptr, indices, data), built on the first row access of a symmetric DSM
+        self.mirror = None
+
+    def __getitem__(self, word: str):
+        i = self.index.get(word)
+        if i is None or i >= self.nRows:
+            raise KeyError(word)
+        return SparseRow(self, i)
+
+    def __contains__(self, word):
+        i = self.index.get(word)
+        return i is not None and i < self.nRows
+
+    def __iter__(self):
+        return iter(self.vocab[:self.nRows])
+
+    def __len__(self):
+        return self.nRows
+
+    def __getstate__(self):
+        # the index is rebuilt from the vocabulary when unpickling, the pickled arrays are not memory-mapped
+        state = self.__dict__.copy()
+        del state["index"]
+        state["mirror"] = None
+        state["directory"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.index = {word: i for i, word in enumerate(self.vocab)}
+
+    def row(self, word: str):
+        """
+        Get the context IDs and co-occurrence counts of a target
+        :param word: the target
+        :return: context IDs, co-occurrence counts
+        """
+        i = self.index[word]
+        if i >= self.nRows:
+            raise KeyError(word)
+        return self.row_arrays(i)
+
+    def row_arrays(self, i: int):
+        """
+        Get the context IDs and co-occurrence counts of a target by its ID
+        :param i: ID of the target
+        :return: context IDs, co-occurrence counts
+        """
+        start, end = self.indptr[i], self.indptr[i + 1]
+        if not self.symmetric:
+            return self.indices[start:end], self.data[start:end]
+        # the contexts with smaller IDs come from the mirrored lower triangle
+        indptr, indices, data = self.lower_triangle()
+        lowerStart, lowerEnd = indptr[i], indptr[i + 1]
+        return (np.concatenate((indices[lowerStart:lowerEnd], self.indices[start:end])),
+                np.concatenate((data[lowerStart:lowerEnd], self.data[start:end])))
+
+    def lower_triangle(self):
+        """
+        Mirror the upper triangle of a symmetric DSM without the diagonal
+        For a memory-mapped DSM, the lower triangle is saved in chunks to a temporary directory and memory-mapped from
+        there, the directory of the DSM is not changed. Otherwise (in memory, or without a writable temporary
+        directory) it is built in memory, as large as the DSM
+        :return: CSR arrays indptr, indices, data of the lower triangle
+        """
+        if self.mirror is None and self.directory is not None:
+            try:
+                scratch = tempfile.mkdtemp(prefix="lower_")
+                try:
+                    save_lower_triangle(self, scratch)
+                    self.mirror = load_lower_triangle(scratch, "r")
+                finally:
+                    # the memory maps stay valid after the files are removed
+                    shutil.rmtree(scratch, ignore_errors=True)
+            except OSError:
+                pass
+        if self.mirror is None:
+            rows = np.repeat(np.arange(self.nRows, dtype=np.int32), np.diff(self.indptr))
+            offDiagonal = np.flatnonzero(rows != self.indices)
+            # stable, so the rows stay sorted within each context
+            order = offDiagonal[np.argsort(self.indices[offDiagonal], kind="stable")]
+            indptr = np.zeros(self.nRows + 1, dtype=np.int64)
+            np.cumsum(np.bincount(self.indices[order], minlength=self.nRows), out=indptr[1:])
+            self.mirror = indptr, rows[order], np.asarray(self.data[order])
+        return self.mirror
+
+    def common_contexts(self, word1: str, word2: str):
+        """
+        Get the co-occurrence counts of both targets for their common contexts
+        :param word1: first target
+        :param word2: second target
+        :return: counts of word1, counts of word2 (aligned arrays)
+        """
+        contexts1, counts1 = self.row(word1)
+        contexts2, counts2 = self.row(word2)
+        common, index1, index2 = np.intersect1d(contexts1, contexts2, assume_unique=True, return_indices=True)
+        return counts1[index1], counts2[index2]
+
+    def row_sums(self, chunkSize: int = 1000000):
+        """
+        Sum up the co-occurrence counts of every target, in chunks of rows, so that the memory does not grow with the DSM
+        :param chunkSize: number of cells processed at a time (at least one row)
+        :return: row sums as array, aligned with the vocabulary
+        """
+        rowSums = np.zeros(self.nRows, dtype=self.data.dtype)
+        startRow = 0
+        while startRow < self.nRows:
+            endRow = np.searchsorted(self.indptr, self.indptr[startRow] + chunkSize, side="right") - 1
+            endRow = min(max(startRow + 1, endRow), self.nRows)
+            start, end = self.indptr[startRow], self.indptr[endRow]
+            cumulative = np.concatenate(([0], np.cumsum(self.data[start:end])))
+            rowSums[startRow:endRow] += (cumulative[self.indptr[startRow + 1:endRow + 1] - start]
+                                         - cumulative[self.indptr[startRow:endRow] - start])
+            if self.symmetric:
+                # add the mirrored counts, the diagonal is only stored once
+                rows = np.repeat(np.arange(startRow, endRow), np.diff(self.indptr[startRow:endRow + 1]))
+                contexts = np.asarray(self.indices[start:end])
+                offDiagonal = rows != contexts
+                rowSums += np.bincount(contexts[offDiagonal], weights=self.data[start:end][offDiagonal],
+                                       minlength=self.nRows).astype(rowSums.dtype)
+            startRow = endRow
+        return rowSums
+
+    def row_totals(self):
+        """
+        Get the row sums of all words of the vocabulary, including words whose rows are not kept
+        :return: row sums as array, aligned with the vocabulary
+        """
+        if self.totals is not None:
+            return self.totals
+        totals = np.zeros(len(self.vocab), dtype=np.int64)
+        totals[:self.nRows] = self.row_sums()
+        return totals
+
+    def entropies(self, chunkSize: int = 1000000):
+        """
+        Calculate the entropy of the context distribution of every target in one pass over the count arrays
+        :param chunkSize: number of cells processed at a time
+        :return: entropies as array, aligned with the vocabulary
+        """
+        rowSums = self.row_sums(chunkSize)
+        entropies = np.zeros(self.nRows)
+        for start in range(0, len(self.data), chunkSize):
+            end = min(start + chunkSize, len(self.data))
+            rows = np.searchsorted(self.indptr, np.arange(start, end), side="right") - 1
+            contexts = np.asarray(self.indices[start:end])
+            counts = np.asarray(self.data[start:end], dtype=np.float64)
+            probabilities = counts / rowSums[rows]
+            entropies += np.bincount(rows, weights=probabilities * np.log2(probabilities), minlength=self.nRows)
+            if self.symmetric:
+                # the mirrored cells belong to the rows of the contexts
+                offDiagonal = rows != contexts
+                probabilities = counts[offDiagonal] / rowSums[contexts[offDiagonal]]
+                entropies += np.bincount(contexts[offDiagonal], weights=probabilities * np.log2(probabilities),
+                                         minlength=self.nRows)
+        return -entropies
+
+    def to_dict(self):
+        """
+        Convert to the DSM as dict[target:dict[context:co-occurrence count]]
+        :return: the DSM
+        """
+        return {word: dict(self[word].items()) for word in self}
+
+    @classmethod
+    def from_dict(cls, dsm: dict):
+        """
+        Convert a DSM as dict[target:dict[context:co-occurrence count]]
+        :param dsm: the DSM
+        :return: SparseDSM
+        """
+        vocab = list(dsm)
+        index = {word: i for i, word in enumerate(vocab)}
+        indptr = np.zeros(len(vocab) + 1, dtype=np.int64)
+        indices = []
+        data = []
+        for i, word in enumerate(vocab):
+            contexts = dsm[word]
+            ids = []
+            for context in contexts:
+                # contexts that are not targets are added after the targets
+                if context not in index:
+                    index[context] = len(vocab)
+                    vocab.append(context)
+                ids.append(index[context])
+            ids = np.array(ids, dtype=np.int32)
+            order = np.argsort(ids)
+            indices.append(ids[order])
+            data.append(np.fromiter(contexts.values(), dtype=np.int64, count=len(contexts))[order])
+            indptr[i + 1] = indptr[i] + len(ids)
+        indices = np.concatenate(indices) if indices else np.zeros(0, dtype=np.int32)
+        data = np.concatenate(data) if data else np.zeros(0, dtype=np.int64)
+
+        return cls(vocab, indptr, indices, data)
+
+    @classmethod
+    def from_coo(cls, vocab: list, nRows: int, rows, cols, data):
+        """
+        Build a SparseDSM from (target ID, context ID, count) triples, counts of duplicate triples are summed up
+        :param vocab: list of lemmas
+        :param nRows: number of targets
+        :param rows: target IDs
+        :param cols: context IDs
+        :param data: co-occurrence counts
+        :return: SparseDSM
+        """
+        keys = (np.asarray(rows, dtype=np.int64) << 32) | np.asarray(cols, dtype=np.int64)
+        keys, data = reduce_counts(keys, np.asarray(data, dtype=np.int64))
+
+        return cls.from_keys(vocab, nRows, keys, data)
+
+    @classmethod
+    def from_keys(cls, vocab: list, nRows: int, keys, data, symmetric: bool = False):
+        """
+        Build a SparseDSM from sorted unique keys (target ID << 32 | context ID) and their counts
+        :param vocab: list of lemmas
+        :param nRows: number of targets
+        :param keys: sorted unique keys
+        :param data: co-occurrence counts aligned with the keys
+        :param symmetric: if True, the keys only contain the upper triangle
+        :return: SparseDSM
+        """
+        indptr = np.zeros(nRows + 1, dtype=np.int64)
+        np.cumsum(np.bincount(keys >> 32, minlength=nRows), out=indptr[1:])
+
+        return cls(vocab, indptr, keys & 0xFFFFFFFF, data, symmetric)
+
+    def save(self, directory: str):
+        """
+        Save the DSM as a directory with the vocabulary (vocab.txt) and the CSR arrays (.npy)
+        :param directory: the directory
+        """
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, "vocab.txt"), "w", encoding="utf-8") as vocabFile:
+            for word in self.vocab:
+                vocabFile.write(word + "\n")
+        np.save(os.path.join(directory, "indptr.npy"), self.indptr)
+        np.save(os.path.join(directory, "indices.npy"), self.indices)
+        np.save(os.path.join(directory, "data.npy"), self.data)
+        if self.totals is not None:
+            np.save(os.path.join(directory, "rowsums.npy"), self.totals)
+        if self.symmetric:
+            # empty file marking the upper triangle
+            open(os.path.join(directory, "symmetric"), "w").close()
+
+    @classmethod
+    def load(cls, directory: str, mmap: bool = False):
+        """
+        Load a DSM saved with save() or SparseDSMWriter
+        :param directory: the directory
+        :param mmap: if True, the row pointers, context IDs and counts are memory-mapped instead of read into memory,
+        a row is only read from disk when it is accessed
+        :return: SparseDSM
+        """
+        with open(os.path.join(directory, "vocab.txt"), encoding="utf-8") as vocabFile:
+            vocab = vocabFile.read().split("\n")[:-1]
+        mmapMode = "r" if mmap else None
+        indptr = np.load(os.path.join(directory, "indptr.npy"), mmap_mode=mmapMode)
+        indices = np.load(os.path.join(directory, "indices.npy"), mmap_mode=mmapMode)
+        data = np.load(os.path.join(directory, "data.npy"), mmap_mode=mmapMode)
+        dsm = cls(vocab, indptr, indices, data, os.path.exists(os.path.join(directory, "symmetric")))
+        if os.path.exists(os.path.join(directory, "rowsums.npy")):
+            dsm.totals = np.load(os.path.join(directory, "rowsums.npy"), mmap_mode=mmapMode)
+        if dsm.symmetric and os.path.exists(os.path.join(directory, "lower_indptr.npy")):
+            # the lower triangle saved by share_dsm()
+            dsm.mirror = load_lower_triangle(directory, mmapMode)
+        if mmap:
+            dsm.directory = directory
+
+        return dsm
+
+
+class SparseRow(Mapping):
+    """
+    Read-only view of one row of a SparseDSM, behaves like dict[context:co-occurrence count]
+    """
+
+    def __init__(self, dsm: SparseDSM, i: int):
+        """
+
+        :param dsm: the SparseDSM
+        :param i: ID of the target
+        """
+        self.dsm = dsm
+        self.contexts, self.counts = dsm.row_arrays(i)
+
+    def position(self, context: str):
+        """
+        Get the position of a context in the row
+        :param context: the context
+        :return: position or -1 if the context does not occur with the target
+        """
+        i = self.dsm.index.get(context)
+        if i is None:
+            return -1
+        position = np.searchsorted(self.contexts, i)
+        if position < len(self.contexts) and self.contexts[position] == i:
+            return position
+        return -1
+
+    def __getitem__(self, context: str):
+        position = self.position(context)
+        if position < 0:
+            raise KeyError(context)
+        return self.counts[position].item()
+
+    def __contains__(self, context):
+        return self.position(context) >= 0
+
+    def __iter__(self):
+        vocab = self.dsm.vocab
+        return (vocab[i] for i in self.contexts.tolist())
+
+    def __len__(self):
+        return len(self.contexts)
+
+    def values(self):
+        return self.counts.tolist()
+
+    def items(self):
+        vocab = self.dsm.vocab
+        return zip([vocab[i] for i in self.contexts.tolist()], self.counts.tolist())
+
+
+def reduce_counts(keys, counts):
+    """
+    Sort keys and sum up the counts of equal keys
+    :param keys: integer keys
+    :param counts: counts aligned with the keys
+    :return: sorted unique keys, summed counts
+    """
+    if len(keys) == 0:
+        return keys, counts
+    order = np.argsort(keys, kind="stable")
+    keys = keys[order]
+    counts = counts[order]
+    starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+
+    return keys[starts], np.add.reduceat(counts, starts)
+
+
+class ArrayWriter:
+
+    def __init__(self, file: str, dtype):
+        """
+        Writes a 1-D .npy file by appending chunks, the header is completed on close
+        :param file: the .npy file
+        :param dtype: the data type of the array
+        """
+        self.dtype = np.dtype(dtype)
+        self.length = 0
+        self.file = open(file, "wb")
+        self.write_header()
+        self.headerLength = self.file.tell()
+
+    def write_header(self):
+        np.lib.format.write_array_header_1_0(self.file, {"descr": np.lib.format.dtype_to_descr(self.dtype),
+                                                         "fortran_order": False, "shape": (self.length,)})
+
+    def append(self, array):
+        """
+        Append a chunk to the array
+        :param array: the chunk
+        """
+        np.asarray(array, dtype=self.dtype).tofile(self.file)
+        self.length += len(array)
+
+    def close(self):
+        self.file.seek(0)
+        self.write_header()
+        # the header is padded to a fixed size, so it can be rewritten in place
+        if self.file.tell() != self.headerLength:
+            raise ValueError("header of " + self.file.name + " changed its size")
+        self.file.close()
+
+
+class SparseDSMWriter:
+
+    def __init__(self, directory: str, vocab: list, nRows: int, totals=None, symmetric: bool = False):
+        """
+        Writes a SparseDSM directory row by row, without keeping the arrays in memory
+        :param directory: the directory
+        :param vocab: list of lemmas
+        :param nRows: number of targets
+        :param totals: optional row sums of all words of the vocabulary
+        :param symmetric: if True, only the upper triangle is appended
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        if totals is not None:
+            np.save(os.path.join(directory, "rowsums.npy"), totals)
+        if symmetric:
+            open(os.path.join(directory, "symmetric"), "w").close()
+        self.symmetric = symmetric
+        with open(os.path.join(directory, "vocab.txt"), "w", encoding="utf-8") as vocabFile:
+            for word in vocab:
+                vocabFile.write(word + "\n")
+        self.rowLengths = np.zeros(nRows, dtype=np.int64)
+        self.indices = ArrayWriter(os.path.join(directory, "indices.npy"), np.int32)
+        self.data = ArrayWriter(os.path.join(directory, "data.npy"), np.int64)
+
+    def append(self, keys, counts):
+        """
+        Append counts, keys have to be larger than all keys appended before
+        :param keys: sorted unique keys (target ID << 32 | context ID)
+        :param counts: co-occurrence counts aligned with the keys
+        """
+        self.rowLengths += np.bincount(keys >> 32, minlength=len(self.rowLengths))
+        self.indices.append(keys & 0xFFFFFFFF)
+        self.data.append(counts)
+
+    def close(self):
+        self.indices.close()
+        self.data.close()
+        indptr = np.zeros(len(self.rowLengths) + 1, dtype=np.int64)
+        np.cumsum(self.rowLengths, out=indptr[1:])
+        np.save(os.path.join(self.directory, "indptr.npy"), indptr)
+
+
+def save_lower_triangle(dsm: SparseDSM, directory: str, chunkSize: int = 10000000):
+    """
+    Save the mirrored lower triangle of a symmetric DSM without the diagonal as CSR arrays (lower_indptr.npy,
+    lower_indices.npy, lower_data.npy), so that it can be memory-mapped like the rest of the DSM
+    The cells are placed in chunks of the upper triangle, the memory does not grow with the DSM
+    :param dsm: the symmetric DSM
+    :param directory: a temporary directory (see lower_triangle) or the shared directory (see share_dsm)
+    :param chunkSize: number of cells processed at a time
+    """
+    chunks = [(start, min(start + chunkSize, len(dsm.indices))) for start in range(0, len(dsm.indices), chunkSize)]
+
+    def off_diagonal(start: int, end: int):
+        rows = np.searchsorted(dsm.indptr, np.arange(start, end), side="right") - 1
+        contexts = np.asarray(dsm.indices[start:end])
+        kept = rows != contexts
+        return rows[kept], contexts[kept], np.asarray(dsm.data[start:end])[kept]
+
+    # the lower row of a context holds the rows of its cells
+    indptr = np.zeros(dsm.nRows + 1, dtype=np.int64)
+    for start, end in chunks:
+        rows, contexts, values = off_diagonal(start, end)
+        indptr[1:] += np.bincount(contexts, minlength=dsm.nRows)
+    np.cumsum(indptr, out=indptr)
+
+    # written under temporary names and replaced, lower_indptr.npy last, it marks a complete lower triangle
+    suffix = "." + str(os.getpid()) + ".npy"
+    files = {name: os.path.join(directory, "lower_" + name + suffix) for name in ("indptr", "indices", "data")}
+    indices = np.lib.format.open_memmap(files["indices"], mode="w+", dtype=np.int32, shape=(int(indptr[-1]),))
+    data = np.lib.format.open_memmap(files["data"], mode="w+", dtype=dsm.data.dtype, shape=(int(indptr[-1]),))
+    # next free position in each lower row, the chunks come in row order, so each lower row stays sorted
+    cursor = indptr[:-1].copy()
+    for start, end in chunks:
+        rows, contexts, values = off_diagonal(start, end)
+        order = np.argsort(contexts, kind="stable")
+        rows, contexts, values = rows[order], contexts[order], values[order]
+        # position of a cell among the cells of its context in this chunk
+        ranks = np.arange(len(contexts)) - np.searchsorted(contexts, contexts, side="left")
+        indices[cursor[contexts] + ranks] = rows
+        data[cursor[contexts] + ranks] = values
+        cursor += np.bincount(contexts, minlength=dsm.nRows)
+    indices.flush()
+    data.flush()
+    del indices, data
+    np.save(files["indptr"], indptr)
+    for name in ("indices", "data", "indptr"):
+        os.replace(files[name], os.path.join(directory, "lower_" + name + ".npy"))
+
+
+def load_lower_triangle(directory: str, mmapMode=None):
+    """
+    Load the lower triangle saved with save_lower_triangle()
+    :param directory: the directory of the DSM
+    :param mmapMode: "r" to memory-map the arrays, None to read them
+    :return: CSR arrays indptr, indices, data of the lower triangle
+    """
+    return tuple(np.load(os.path.join(directory, "lower_" + name + ".npy"), mmap_mode=mmapMode)
+                 for name in ("indptr", "indices", "data"))
+
+
+def save_dict(dsm: dict, directory: str, chunkSize: int = 1000000):
+    """
+    Save a DSM given as dict[target:dict[context:co-occurrence count]] as SparseDSM directory, row by row
+    with SparseDSMWriter, the arrays of the whole DSM are never built in memory (same result as from_dict and save)
+    :param dsm: the DSM
+    :param directory: the directory
+    :param chunkSize: number of counts collected before they are appended to the files
+    """
+    vocab = list(dsm)
+    index = {word: i for i, word in enumerate(vocab)}
+    for contexts in dsm.values():
+        for context in contexts:
+            # contexts that are not targets are added after the targets
+            if context not in index:
+                index[context] = len(vocab)
+                vocab.append(context)
+    writer = SparseDSMWriter(directory, vocab, len(dsm))
+    keyChunks = []
+    countChunks = []
+    buffered = 0
+    for i, contexts in enumerate(dsm.values()):
+        ids = np.fromiter((index[context] for context in contexts), dtype=np.int64, count=len(contexts))
+        order = np.argsort(ids)
+        keyChunks.append((i << 32) | ids[order])
+        countChunks.append(np.fromiter(contexts.values(), dtype=np.int64, count=len(contexts))[order])
+        buffered += len(ids)
+        if buffered >= chunkSize:
+            writer.append(np.concatenate(keyChunks), np.concatenate(countChunks))
+            keyChunks = []
+            countChunks = []
+            buffered = 0
+    if keyChunks:
+        writer.append(np.concatenate(keyChunks), np.concatenate(countChunks))
+    writer.close()
+
+
+def save_run(keys, counts, file: str):
+    """
+    Save a sorted run of counts
+    :param keys: sorted unique keys
+    :param counts: counts aligned with the keys
+    :param file: file prefix of the run
+    :return: file prefix of the run
+    """
+    np.save(file + ".keys.npy", keys)
+    np.save(file + ".counts.npy", counts)
+    return file
+
+
+def load_run(file: str):
+    """
+    Memory-map a run saved with save_run()
+    :param file: file prefix of the run
+    :return: keys, counts
+    """
+    return np.load(file + ".keys.npy", mmap_mode="r"), np.load(file + ".counts.npy", mmap_mode="r")
+
+
+def merge_runs(runs: list, writer: SparseDSMWriter, chunkSize: int):
+    """
+    k-way merge of sorted runs, at most chunkSize entries are read from the runs at a time
+    :param runs: list of (keys, counts), usually memory-mapped
+    :param writer: the writer receiving the merged counts
+    :param chunkSize: number of entries merged at a time
+    """
+    runs = [run for run in runs if len(run[0]) > 0]
+    positions = [0] * len(runs)
+    step = max(1, chunkSize // max(1, len(runs)))
+    while runs:
+        # no run contributes more than step entries below the upper bound
+        upper = None
+        for (keys, counts), position in zip(runs, positions):
+            if position + step < len(keys):
+                upper = keys[position + step] if upper is None else min(upper, keys[position + step])
+        keyChunks = []
+        countChunks = []
+        for i, (keys, counts) in enumerate(runs):
+            end = len(keys) if upper is None else np.searchsorted(keys, upper)
+            keyChunks.append(keys[positions[i]:end])
+            countChunks.append(counts[positions[i]:end])
+            positions[i] = end
+        writer.append(*reduce_counts(np.concatenate(keyChunks), np.concatenate(countChunks)))
+        remaining = [i for i, (keys, counts) in enumerate(runs) if positions[i] < len(keys)]
+        runs = [runs[i] for i in remaining]
+        positions = [positions[i] for i in remaining]
+
+
+def remapped_runs(dsm: SparseDSM, mapping, chunkSize: int, keep=None, expand: bool = False):
+    """
+    Map the IDs of a SparseDSM to another vocabulary, the rows are processed in chunks of about chunkSize entries
+    The upper triangle of a symmetric DSM stays an upper triangle, unless it is expanded to all rows
+    :param dsm: the SparseDSM
+    :param mapping: array mapping the IDs of dsm to the new IDs
+    :param chunkSize: number of entries per chunk, None for a single chunk
+    :param keep: optional boolean array over the new IDs, only rows marked True are kept
+    :param expand: if True, the mirrored lower triangle of a symmetric DSM is added
+    :return: generator of sorted runs (keys, counts) with the new IDs
+    """
+    if chunkSize is None:
+        chunkSize = max(1, len(dsm.data))
+    startRow = 0
+    while startRow < dsm.nRows:
+        endRow = np.searchsorted(dsm.indptr, dsm.indptr[startRow] + chunkSize, side="right") - 1
+        endRow = min(max(startRow + 1, endRow), dsm.nRows)
+        start, end = dsm.indptr[startRow], dsm.indptr[endRow]
+        rows = np.repeat(np.arange(startRow, endRow), np.diff(dsm.indptr[startRow:endRow + 1]))
+        rows = mapping[rows]
+        cols = mapping[dsm.indices[start:end]]
+        counts = np.asarray(dsm.data[start:end])
+        if dsm.symmetric and expand:
+            offDiagonal = rows != cols
+            rows, cols = np.concatenate((rows, cols[offDiagonal])), np.concatenate((cols, rows[offDiagonal]))
+            counts = np.concatenate((counts, counts[offDiagonal]))
+        elif dsm.symmetric:
+            rows, cols = np.minimum(rows, cols), np.maximum(rows, cols)
+        if keep is not None:
+            kept = keep[rows]
+            rows = rows[kept]
+            cols = cols[kept]
+            counts = counts[kept]
+        keys = (rows << 32) | cols
+        order = np.argsort(keys)
+        if len(keys) > 0:
+            yield keys[order], counts[order]
+        startRow = endRow
+
+
+def build_sparse(vocab: list, nRows: int, runs, directory: str = None, memoryBudget: int = None, totals=None,
+                 symmetric: bool = False):
+    """
+    Build a SparseDSM from sorted runs, in memory or with a memory budget by saving the runs in directory
+    and merging them with a k-way merge into directory/dsm, the result is then memory-mapped
+    :param vocab: list of lemmas
+    :param nRows: number of targets
+    :param runs: iterable of sorted runs (keys, counts)
+    :param directory: directory for the runs and the result (with memoryBudget)
+    :param memoryBudget: memory budget in bytes for the counts
+    :param totals: optional row sums of all words of the vocabulary
+    :param symmetric: if True, the runs only contain the upper triangle
+    :return: SparseDSM
+    """
+    if memoryBudget is None:
+        runs = list(runs)
+        keys = np.concatenate([run[0] for run in runs]) if runs else np.zeros(0, dtype=np.int64)
+        counts = np.concatenate([run[1] for run in runs]) if runs else np.zeros(0, dtype=np.int64)
+        dsm = SparseDSM.from_keys(vocab, nRows, *reduce_counts(keys, counts), symmetric)
+        dsm.totals = totals
+        return dsm
+
+    runFiles = [save_run(keys, counts, os.path.join(directory, "run" + str(i))) for i, (keys, counts) in enumerate(runs)]
+    writer = SparseDSMWriter(os.path.join(directory, "dsm"), vocab, nRows, totals, symmetric)
+    # a key and a count take 16 bytes
+    merge_runs([load_run(runFile) for runFile in runFiles], writer, max(1, memoryBudget // 16))
+    writer.close()
+
+    return SparseDSM.load(os.path.join(directory, "dsm"), mmap=True)
+
+
+def combine_sparse(spaces, directory: str = None, memoryBudget: int = None):
+    """
+    Combine multiple SparseDSM's and word frequency counts into one, the vocabulary is merged in order
+    Each part is mapped to IDs in the order its words are first seen, sorted into runs and released, so that only one
+    part is open at a time. The runs are then mapped to the final IDs (targets first), sorted again and merged
+    With a memory budget, the runs have at most memoryBudget bytes and are saved in directory, they are merged with
+    a k-way merge into directory/dsm and the result is memory-mapped
+    :param spaces: list or iterator yielding tuples of (SparseDSM, word frequency)
+    :param directory: directory for the runs and the result (with memoryBudget)
+    :param memoryBudget: memory budget in bytes for the counts
+    :return: SparseDSM, word frequency
+    """
+    # IDs in the order the words are first seen, in any part
+    index = {}
+    targets = {}
+    contextsOnly = {}
+    wordFrequencyCombine = {}
+    totals = np.zeros(0, dtype=np.int64)
+    # row sums of all words are only kept if a part was restricted to some targets
+    restricted = False
+    # the result only stays symmetric if all parts are, otherwise the symmetric parts are expanded to all rows
+    symmetric = True
+    # (keys, counts) or the file of a saved run, and whether its part is symmetric
+    runs = []
+    chunkSize = max(1, memoryBudget // 16) if memoryBudget is not None else None
+    for dsm, wordFrequency in spaces:
+        for word, freq in wordFrequency.items():
+            wordFrequencyCombine[word] = wordFrequencyCombine.get(word, 0) + freq
+        for word in dsm.vocab[:dsm.nRows]:
+            targets.setdefault(word, None)
+        for word in dsm.vocab[dsm.nRows:]:
+            contextsOnly.setdefault(word, None)
+        mapping = np.fromiter((index.setdefault(word, len(index)) for word in dsm.vocab), dtype=np.int64,
+                              count=len(dsm.vocab))
+        if len(totals) < len(index):
+            totals = np.concatenate((totals, np.zeros(len(index) - len(totals), dtype=np.int64)))
+        np.add.at(totals, mapping, dsm.row_totals())
+        restricted = restricted or dsm.totals is not None
+        symmetric = symmetric and dsm.symmetric
+        for keys, counts in remapped_runs(dsm, mapping, chunkSize):
+            if memoryBudget is not None:
+                runs.append((save_run(keys, counts, os.path.join(directory, "unmapped" + str(len(runs)))),
+                             dsm.symmetric))
+            else:
+                runs.append(((keys, counts), dsm.symmetric))
+        del dsm, mapping
+
+    vocab = list(targets) + [word for word in contextsOnly if word not in targets]
+    order = np.fromiter((index[word] for word in vocab), dtype=np.int64, count=len(vocab))
+    del index, contextsOnly
+    mapping = np.empty(len(order), dtype=np.int64)
+    mapping[order] = np.arange(len(order))
+
+    def final_runs():
+        for run, partSymmetric in runs:
+            keys, counts = load_run(run) if memoryBudget is not None else run
+            rows = mapping[keys >> 32]
+            cols = mapping[keys & 0xFFFFFFFF]
+            counts = np.asarray(counts)
+            if partSymmetric and not symmetric:
+                offDiagonal = rows != cols
+                rows, cols = np.concatenate((rows, cols[offDiagonal])), np.concatenate((cols, rows[offDiagonal]))
+                counts = np.concatenate((counts, counts[offDiagonal]))
+            elif partSymmetric:
+                rows, cols = np.minimum(rows, cols), np.maximum(rows, cols)
+            keys = (rows << 32) | cols
+            keyOrder = np.argsort(keys)
+            yield keys[keyOrder], counts[keyOrder]
+            if memoryBudget is not None:
+                # the run is saved again with the final IDs by build_sparse
+                os.remove(run + ".keys.npy")
+                os.remove(run + ".counts.npy")
+
+    return (build_sparse(vocab, len(targets), final_runs(), directory, memoryBudget,
+                         totals[order] if restricted else None, symmetric),
+            wordFrequencyCombine)
+
+
+def restrict_rows(dsm: SparseDSM, words: set, directory: str = None, memoryBudget: int = None):
+    """
+    Keep only the rows of the given words, the vocabulary is reordered so that these words come first
+    The row sums of all words are kept as totals, so that marginals stay exact
+    :param dsm: the SparseDSM
+    :param words: the words whose rows are kept
+    :param directory: directory for the runs and the result (with memoryBudget)
+    :param memoryBudget: memory budget in bytes for the counts
+    :return: SparseDSM
+    """
+    keep = np.zeros(len(dsm.vocab), dtype=bool)
+    keep[[i for i, word in enumerate(dsm.vocab[:dsm.nRows]) if word in words]] = True
+    order = np.concatenate((np.flatnonzero(keep), np.flatnonzero(~keep)))
+    mapping = np.empty(len(order), dtype=np.int64)
+    mapping[order] = np.arange(len(order))
+    vocab = [dsm.vocab[i] for i in order.tolist()]
+    totals = dsm.row_totals()[order]
+
+    chunkSize = max(1, memoryBudget // 16) if memoryBudget is not None else None
+    # rows of a symmetric DSM are completed with the mirrored counts before they are dropped
+    runs = remapped_runs(dsm, mapping, chunkSize, keep[order], expand=True)
+
+    return build_sparse(vocab, int(keep.sum()), runs, directory, memoryBudget, totals)
+
+
+def row_contexts(dsm: SparseDSM, words: set):
+    """
+    Get all contexts occurring in the rows of the given words
+    :param dsm: the SparseDSM
+    :param words: the targets
+    :return: set of contexts
+    """
+    contexts = set()
+    for word in words:
+        if word in dsm:
+            contexts.update(dsm.vocab[i] for i in dsm.row(word)[0].tolist())
+    return contexts
+
+
+def read_dsm(file: str):
+    """
+    Read a DSM, either a SparseDSM directory or a pickled dict[target:dict[context:co-occurrence count]]
+    A SparseDSM is memory-mapped, only the rows that are accessed are read from disk
+    :param file: the directory or pickle file
+    :return: the DSM
+    """
+    if os.path.isdir(file):
+        return SparseDSM.load(file, mmap=True)
+    return pickle.load(open(file, "rb"))
+
+
+def marginals_directory(dsmFile: str):
+    """
+    Get the directory of the marginals of a DSM, the directory of a SparseDSM or <dsm_file>.marginals for a pickle file
+    :param dsmFile: the directory or pickle file of the DSM
+    :return: the directory
+    """
+    if os.path.isdir(dsmFile):
+        return dsmFile
+    return dsmFile + ".marginals"
+
+
+def save_marginals(dsm, wordFrequency: dict, dsmFile: str):
+    """
+    Save the row sums, the word frequencies and the sample size of a saved DSM as arrays aligned with the vocabulary
+    (rowsums.npy, frequency.npy, samplesize.npy), so that they can be read without loading the DSM
+    :param dsm: the DSM, SparseDSM or dict
+    :param wordFrequency: the word frequencies
+    :param dsmFile: the directory or pickle file the DSM was saved to
+    """
+    directory = marginals_directory(dsmFile)
+    if isinstance(dsm, SparseDSM):
+        vocab = dsm.vocab
+        rowSums = dsm.row_totals()
+    else:
+        vocab = list(dsm)
+        rowSums = np.fromiter((sum(contexts.values()) for contexts in dsm.values()), dtype=np.int64, count=len(dsm))
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, "vocab.txt"), "w", encoding="utf-8") as vocabFile:
+        for word in vocab:
+            vocabFile.write(word + "\n")
+    np.save(os.path.join(directory, "rowsums.npy"), rowSums)
+    np.save(os.path.join(directory, "frequency.npy"),
+            np.fromiter((wordFrequency.get(word, 0) for word in vocab), dtype=np.int64, count=len(vocab)))
+    save_entropies(dsm, dsmFile)
+    # written last, marks complete marginals
+    np.save(os.path.join(directory, "samplesize.npy"), np.int64(rowSums.sum()))
+
+
+def has_marginals(file: str):
+    """
+    Check whether marginals were saved for a DSM
+    :param file: the directory or pickle file of the DSM
+    :return: True if there are marginals
+    """
+    return os.path.exists(os.path.join(marginals_directory(file), "samplesize.npy"))
+
+
+def read_marginal(file: str, name: str):
+    """
+    Read row sums or word frequencies from the marginals of a DSM
+    :param file: the directory or pickle file of the DSM
+    :param name: "rowsums" or "frequency"
+    :return: dict[word:count]
+    """
+    directory = marginals_directory(file)
+    with open(os.path.join(directory, "vocab.txt"), encoding="utf-8") as vocabFile:
+        vocab = vocabFile.read().split("\n")[:-1]
+    return dict(zip(vocab, np.load(os.path.join(directory, name + ".npy")).tolist()))
+
+
+def read_row_sums(file: str, dsm=None):
+    """
+    Read row sums, either the marginals of a DSM or a pickled dict[word:row sum] (see rowSums.py)
+    :param file: the directory or pickle file of the DSM, or the pickle file of the row sums
+    :param dsm: optional DSM read with read_dsm(), if file is the directory it was memory-mapped from,
+    its memory-mapped row sums are used instead of reading a copy
+    :return: row sums as dict (or WordArray)
+    """
+    if (isinstance(dsm, SparseDSM) and dsm.directory is not None and dsm.totals is not None
+            and os.path.isdir(file) and os.path.samefile(file, dsm.directory)):
+        return WordArray(dsm.vocab, dsm.index, dsm.totals)
+    if has_marginals(file):
+        return read_marginal(file, "rowsums")
+    return pickle.load(open(file, "rb"))
+
+
+def read_sample_size(file: str):
+    """
+    Read the sample size (sum of all row sums) from the marginals of a DSM
+    :param file: the directory or pickle file of the DSM, or the pickle file of the row sums
+    :return: the sample size, None if there are no marginals
+    """
+    if has_marginals(file):
+        return int(np.load(os.path.join(marginals_directory(file), "samplesize.npy")))
+    return None
+
+
+class WordArray(Mapping):
+    """
+    Read-only dict[word:value] backed by an array aligned with a vocabulary (e.g. the memory-mapped row sums of a
+    SparseDSM), the array may only cover the first words of the vocabulary
+    """
+
+    def __init__(self, vocab: list, index: dict, values):
+        """
+
+        :param vocab: list of lemmas
+        :param index: dict[lemma:position in the vocabulary]
+        :param values: the values of the first len(values) words of the vocabulary
+        """
+        self.vocab = vocab
+        self.index = index
+        self.values = values
+
+    def __getitem__(self, word: str):
+        i = self.index.get(word)
+        if i is None or i >= len(self.values):
+            raise KeyError(word)
+        return self.values[i].item()
+
+    def __contains__(self, word):
+        i = self.index.get(word)
+        return i is not None and i < len(self.values)
+
+    def __iter__(self):
+        return iter(self.vocab[:len(self.values)])
+
+    def __len__(self):
+        return len(self.values)
+
+
+def row_sums_array(dsm: SparseDSM, rowSums):
+    """
+    Align row sums with the vocabulary of a SparseDSM
+    :param dsm: the SparseDSM
+    :param rowSums: the row sums as dict (or WordArray)
+    :return: array of the row sums, 0 for words without row sum
+    """
+    if isinstance(rowSums, WordArray) and rowSums.index is dsm.index and len(rowSums) == len(dsm.vocab):
+        return rowSums.values
+    return np.fromiter((rowSums.get(word, 0) for word in dsm.vocab), dtype=np.int64, count=len(dsm.vocab))
+
+
+def entropy_array(dsm):
+    """
+    Calculate the entropy of the context distribution of every target
+    :param dsm: the DSM, SparseDSM or dict
+    :return: entropies as array, aligned with the targets (list(dsm))
+    """
+    if isinstance(dsm, SparseDSM):
+        return dsm.entropies()
+    entropies = np.zeros(len(dsm))
+    for i, contexts in enumerate(dsm.values()):
+        counts = np.fromiter(contexts.values(), dtype=np.float64, count=len(contexts))
+        probabilities = counts / counts.sum()
+        entropies[i] = -(probabilities * np.log2(probabilities)).sum()
+    return entropies
+
+
+def word_entropies(dsm):
+    """
+    Calculate the entropies of all targets in memory, see read_entropies() for the saved entropies
+    :param dsm: the DSM, SparseDSM or dict
+    :return: entropies as read-only dict[target:entropy]
+    """
+    if isinstance(dsm, SparseDSM):
+        return WordArray(dsm.vocab, dsm.index, dsm.entropies())
+    return dict(zip(dsm, entropy_array(dsm).tolist()))
+
+
+def save_entropies(dsm, dsmFile: str):
+    """
+    Save the entropies of the targets of a saved DSM with its marginals (entropy.npy), aligned with the vocabulary
+    of a SparseDSM, or with entropy_vocab.txt for a pickled DSM (its vocab.txt belongs to the other marginals)
+    :param dsm: the DSM, SparseDSM or dict
+    :param dsmFile: the directory or pickle file the DSM was saved to
+    """
+    directory = marginals_directory(dsmFile)
+    entropies = entropy_array(dsm)
+    os.makedirs(directory, exist_ok=True)
+    # replaced at once, other processes may read or save the entropies at the same time
+    if not isinstance(dsm, SparseDSM):
+        temporary = os.path.join(directory, "entropy_vocab." + str(os.getpid()) + ".txt")
+        with open(temporary, "w", encoding="utf-8") as vocabFile:
+            for word in dsm:
+                vocabFile.write(word + "\n")
+        os.replace(temporary, os.path.join(directory, "entropy_vocab.txt"))
+    temporary = os.path.join(directory, "entropy." + str(os.getpid()) + ".npy")
+    np.save(temporary, entropies)
+    os.replace(temporary, os.path.join(directory, "entropy.npy"))
+
+
+def read_entropy_vocab(directory: str):
+    """
+    Read the vocabulary of the entropies of a pickled DSM (see save_entropies)
+    :param directory: the marginals directory
+    :return: list of words, None if it is missing
+    """
+    file = os.path.join(directory, "entropy_vocab.txt")
+    if not os.path.exists(file):
+        return None
+    with open(file, encoding="utf-8") as vocabFile:
+        return vocabFile.read().split("\n")[:-1]
+
+
+def read_entropies(dsmFile: str, dsm):
+    """
+    Read the entropies of the targets saved next to a DSM (see save_marginals), they are calculated in memory if they
+    are missing, older than the DSM or saved for other words, the directory of the DSM is never changed
+    :param dsmFile: the directory or pickle file of the DSM
+    :param dsm: the DSM read from dsmFile
+    :return: entropies as read-only dict[target:entropy]
+    """
+    directory = marginals_directory(dsmFile)
+    file = os.path.join(directory, "entropy.npy")
+    source = os.path.join(dsmFile, "data.npy") if os.path.isdir(dsmFile) else dsmFile
+    if not os.path.exists(file) or os.path.getmtime(file) < os.path.getmtime(source):
+        return word_entropies(dsm)
+    entropies = np.load(file, mmap_mode="r")
+    if isinstance(dsm, SparseDSM):
+        if len(entropies) != dsm.nRows:
+            return word_entropies(dsm)
+        return WordArray(dsm.vocab, dsm.index, entropies)
+    vocab = read_entropy_vocab(directory)
+    if vocab != list(dsm) or len(vocab) != len(entropies):
+        return word_entropies(dsm)
+    return dict(zip(vocab, entropies.tolist()))
+
+
+# RAM-backed file system for the shared DSM's, files in it are shared memory that any process can map by name
+SHARED_MEMORY = "/dev/shm"
+
+
+def shared_directory(name: str):
+    """
+    Get the directory of a DSM shared with dsm_share.py
+    :param name: the name of the shared DSM
+    :return: the directory
+    """
+    return os.path.join(SHARED_MEMORY, "dsm_" + name)
+
+
+def share_dsm(dsm, rowSums: dict, directory: str, sampleSize: int = None):
+    """
+    Save a DSM with its row sums as a SparseDSM in shared memory, the processes that read it with read_dsm()
+    memory-map the same pages instead of holding their own copy
+    The lower triangle of a symmetric DSM and the entropies are saved as well (see save_lower_triangle and
+    save_entropies), so that they are not calculated by every process
+    :param dsm: the DSM, SparseDSM or dict
+    :param rowSums: the row sums of the words of the DSM
+    :param directory: the directory, usually shared_directory(name)
+    :param sampleSize: optional sample size, the sum of the row sums otherwise
+    """
+    if isinstance(dsm, SparseDSM):
+        dsm.save(directory)
+    else:
+        save_dict(dsm, directory)
+    with open(os.path.join(directory, "vocab.txt"), encoding="utf-8") as vocabFile:
+        vocab = vocabFile.read().split("\n")[:-1]
+    np.save(os.path.join(directory, "rowsums.npy"),
+            np.fromiter((rowSums.get(word, 0) for word in vocab), dtype=np.int64, count=len(vocab)))
+    if isinstance(dsm, SparseDSM) and dsm.symmetric:
+        save_lower_triangle(dsm, directory)
+    save_entropies(dsm, directory)
+    if sampleSize is None:
+        sampleSize = sum(rowSums.values())
+    # written last, marks complete marginals
+    np.save(os.path.join(directory, "samplesize.npy"), np.int64(sampleSize))